@@ -0,0 +1,374 @@
+"""
+Python interface to the KAIROSCOPE capture, sign and export workflow.
+
+The CLI commands are thin wrappers around these functions. Callers using them directly
+must first select a key backend with kairoscope.provenance.set_key_manager.
+"""
+
+import contextlib
+import hashlib
+import io
+import os
+import shutil
+import sys
+import tarfile
+import tempfile
+import time
+import uuid
+from collections.abc import Iterator
+from pathlib import Path
+from typing import Any
+
+from kairoscope import serialization
+from kairoscope.db import (
+    cache_path_hash,
+    get_all_artifact_hashes,
+    get_artifact_json_by_hash,
+    get_artifact_metadata_by_hash,
+    get_cached_path_hash,
+    insert_artifact_metadata,
+    insert_event,
+)
+from kairoscope.policy import can_export
+from kairoscope.provenance import (
+    copy_and_hash,
+    create_assertion,
+    get_public_key_fingerprint,
+    sha256_file,
+    sha256_many,
+    sign_bytes,
+)
+from kairoscope.sbom import generate_sbom
+from kairoscope.slsa import generate_slsa_attestation
+
+
+class ExportBlocked(Exception):
+    """Raised when policy or artifact integrity checks prevent an export."""
+
+
+def get_dist_dir() -> Path:
+    return Path.cwd() / "dist"
+
+
+def _get_timestamp() -> str:
+    """Returns a deterministic timestamp for ledger entries."""
+    # For testing, this can be mocked. For production, it's current UTC time.
+    seconds, nanos = divmod(time.time_ns(), 1_000_000_000)
+    return time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(seconds)) + f".{nanos // 1_000_000:03d}Z"
+
+
+class _SendfileTarFile(tarfile.TarFile):
+    """
+    Uncompressed TarFile that copies member data with os.sendfile, so artifact bytes stay
+    in the kernel instead of passing through a userspace copy loop.
+    """
+
+    def addfile(self, tarinfo, fileobj=None, *args, **kwargs):
+        if fileobj is None or not tarinfo.isreg() or not hasattr(os, "sendfile"):
+            return super().addfile(tarinfo, fileobj, *args, **kwargs)
+        self._check("awx")
+        header = tarinfo.tobuf(self.format, self.encoding, self.errors)
+        self.fileobj.write(header)
+        self.offset += len(header)
+        self.fileobj.flush()
+
+        out_fd, in_fd = self.fileobj.fileno(), fileobj.fileno()
+        sent, size = 0, tarinfo.size
+        while sent < size:
+            count = os.sendfile(out_fd, in_fd, sent, size - sent)
+            if count == 0:
+                raise tarfile.WriteError(f"unexpected end of data in {tarinfo.name}")
+            sent += count
+
+        blocks, remainder = divmod(size, tarfile.BLOCKSIZE)
+        if remainder:
+            self.fileobj.write(tarfile.NUL * (tarfile.BLOCKSIZE - remainder))
+            blocks += 1
+        self.offset += blocks * tarfile.BLOCKSIZE
+        self.members.append(tarinfo)
+
+
+# Buffer size for gzip tarball output and for copying member data into it
+_TARBALL_BUFFER_SIZE = 1024 * 1024
+
+
+def _gzip_compresslevel() -> int:
+    """
+    Returns the gzip level for .tar.gz exports: KAIROSCOPE_TAR_COMPRESSLEVEL if set,
+    otherwise tarfile's default of 9. Level 0 still writes a valid, uncompressed gzip stream.
+    Raises ValueError if the variable isn't an integer from 0 to 9.
+    """
+    value = os.environ.get("KAIROSCOPE_TAR_COMPRESSLEVEL", "9")
+    try:
+        level = int(value)
+    except ValueError:
+        level = -1
+    if not 0 <= level <= 9:
+        raise ValueError(
+            f"KAIROSCOPE_TAR_COMPRESSLEVEL must be an integer from 0 to 9, got {value!r}."
+        )
+    return level
+
+
+@contextlib.contextmanager
+def _open_tarball(output: Path, compresslevel: int) -> Iterator[tarfile.TarFile]:
+    """
+    Opens the export tarball for writing. Artifacts are content-addressed blobs that rarely
+    compress, so a plain .tar output skips gzip and streams member data with sendfile.
+    """
+    if output.suffix == ".tar":
+        with _SendfileTarFile.open(output, "w") as tar:
+            yield tar
+        return
+    # Members are read in large chunks, and gzip's output is collected in a large write
+    # buffer, so the file is written in few syscalls rather than one per compressed block
+    with (
+        open(output, "wb", buffering=_TARBALL_BUFFER_SIZE) as f,
+        tarfile.open(fileobj=f, mode="w:gz", compresslevel=compresslevel) as tar,
+    ):
+        tar.copybufsize = _TARBALL_BUFFER_SIZE  # type: ignore[attr-defined]
+        yield tar
+
+
+# Artifact sets up to this size are tarred in memory rather than streamed to disk
+_IN_MEMORY_TARBALL_LIMIT = 8 * 1024 * 1024
+
+
+def _write_tarball_in_memory(
+    output: Path, members: list[os.DirEntry[str]], compresslevel: int
+) -> str:
+    """
+    Builds the export tarball in memory, writes it to output in one call and returns its
+    SHA256 hex digest, hashed from memory instead of read back from disk.
+    """
+    buffer = io.BytesIO()
+    if output.suffix == ".tar":
+        tar = tarfile.open(fileobj=buffer, mode="w")
+    else:
+        tar = tarfile.open(fileobj=buffer, mode="w:gz", compresslevel=compresslevel)
+    with tar:
+        for entry in members:
+            tar.add(entry.path, arcname=f"artifacts/{entry.name}")
+    data = buffer.getbuffer()
+    output.write_bytes(data)
+    return hashlib.sha256(data).hexdigest()
+
+
+def _canonical_json(stored_json: str) -> str:
+    """
+    Re-encodes JSON read from the database in the form capture returns for new records.
+    Rows written by earlier versions used json.dumps defaults, with spaces and unsorted keys.
+    """
+    return serialization.dumps(serialization.loads(stored_json), sort_keys=True)
+
+
+def _path_cache_key(source_stat: os.stat_result) -> tuple[int, int, int, int]:
+    """Returns the (mtime_ns, size, ctime_ns, inode) a path cache entry is validated by."""
+    return (
+        source_stat.st_mtime_ns,
+        source_stat.st_size,
+        source_stat.st_ctime_ns,
+        source_stat.st_ino,
+    )
+
+
+def capture(path: Path | None, db_path: Path) -> tuple[str, str, bool]:
+    """
+    Captures content from a file, or from stdin when path is None, and records it.
+    Returns (content hash, artifact JSON, created); created is False when the content had
+    already been captured, in which case the stored artifact JSON is returned.
+    """
+    if path is not None:
+        # A file captured before and unchanged since is answered from the path cache,
+        # without hashing its content again. Unchanged means the same mtime, size, ctime
+        # and inode: ctime can't be set back by restoring the mtime, and a file replaced
+        # by rename has a new inode. A same-size in-place rewrite that lands within the
+        # filesystem's timestamp granularity of the previous write still goes unnoticed;
+        # that is the price of not reading the content.
+        source_path = str(path.resolve())
+        source_key = _path_cache_key(os.stat(source_path))
+        cached_hash = get_cached_path_hash(source_path, *source_key, db_path)
+        existing_artifact_json = cached_hash and get_artifact_json_by_hash(cached_hash, db_path)
+        if cached_hash and existing_artifact_json:
+            return cached_hash, _canonical_json(existing_artifact_json), False
+
+    # Stage the content in a temporary file under artifacts/ without holding it in memory.
+    # It is renamed to its content hash once that is known.
+    artifact_dir = Path.cwd() / "artifacts"
+    artifact_dir.mkdir(exist_ok=True)
+    tmp_fd, tmp_name = tempfile.mkstemp(dir=artifact_dir, prefix=".capture-")
+    os.close(tmp_fd)
+    tmp_path = Path(tmp_name)
+    try:
+        if path is not None:
+            # The file is copied first and the private staged copy is hashed, so the hash
+            # always matches the stored content even if the source changes meanwhile. Both
+            # passes stay zero-copy: copyfile uses sendfile on Linux and sha256_file maps
+            # the copy straight from the page cache.
+            shutil.copyfile(path, tmp_path)
+            content_hash = sha256_file(tmp_path)
+            # A source modified during the copy isn't cached under its earlier stat
+            if _path_cache_key(os.stat(source_path)) == source_key:
+                cache_path_hash(source_path, *source_key, content_hash, db_path)
+        else:
+            with open(tmp_path, "wb") as tmp_file:
+                content_hash = copy_and_hash(sys.stdin.buffer, tmp_file)
+
+        # content_hash is already a uniformly distributed SHA-256, so its leading 16 bytes
+        # make a stable, name-based UUID without hashing it again.
+        artifact_id = str(uuid.UUID(bytes=bytes.fromhex(content_hash)[:16], version=5))
+
+        # Check if artifact already exists in DB
+        existing_artifact_json = get_artifact_json_by_hash(content_hash, db_path)
+        if existing_artifact_json:
+            return content_hash, _canonical_json(existing_artifact_json), False
+
+        # Store raw artifact content in artifacts/ directory
+        tmp_path.replace(artifact_dir / content_hash)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+    artifact_record = {
+        "id": artifact_id,
+        "kind": "capture",
+        "uri": f"file://{content_hash}",
+        "hash": content_hash,
+    }
+    insert_artifact_metadata(artifact_record, db_path)
+
+    insert_event(
+        {
+            "ts": _get_timestamp(),
+            "action": "capture",
+            "by": get_public_key_fingerprint(),
+            "artifact_hash": content_hash,
+            "artifact_id": artifact_id,
+        },
+        db_path,
+    )
+    return content_hash, serialization.dumps(artifact_record, sort_keys=True), True
+
+
+def sign(artifact_hash: str, db_path: Path) -> tuple[dict[str, Any], bool]:
+    """
+    Signs an artifact record and attaches a C2PA-like assertion.
+    Returns (artifact record, signed); signed is False when the artifact was already signed.
+    Raises ValueError if no artifact with that hash has been captured.
+    """
+    artifact_record = get_artifact_metadata_by_hash(artifact_hash, db_path)
+    if not artifact_record:
+        raise ValueError(f"Artifact with hash {artifact_hash} not found.")
+
+    if "c2pa_assertion" in artifact_record:
+        return artifact_record, False
+
+    signature = sign_bytes(artifact_hash.encode("utf-8"))
+    signature_hex = signature.hex()
+
+    assertion = create_assertion(artifact_hash, signature_hex)
+    artifact_record["c2pa_assertion"] = assertion
+
+    insert_artifact_metadata(artifact_record, db_path)  # Update the artifact record in DB
+
+    insert_event(
+        {
+            "ts": _get_timestamp(),
+            "action": "sign",
+            "by": get_public_key_fingerprint(),
+            "artifact_hash": artifact_hash,
+            "artifact_signature": signature_hex,
+            "c2pa_assertion": assertion,
+        },
+        db_path,
+    )
+    return artifact_record, True
+
+
+def export(
+    output: Path, checksums: Path, db_path: Path, sbom: bool = False, slsa: bool = False
+) -> dict[str, Any] | None:
+    """
+    Packages all artifacts into a tarball and writes its SHA256SUMS entry.
+    Returns None if there is nothing to export, otherwise a dict with the tarball_hash and
+    the sbom_path and slsa_path written (None when not requested).
+    Raises ExportBlocked if the policy or an artifact integrity check fails, ValueError if
+    KAIROSCOPE_TAR_COMPRESSLEVEL is invalid, and RuntimeError if SBOM generation fails.
+    """
+    # Reject a bad compression setting before doing any work
+    compresslevel = _gzip_compresslevel()
+    all_artifact_hashes = get_all_artifact_hashes(db_path)
+
+    if not all_artifact_hashes:
+        return None
+
+    if not can_export(all_artifact_hashes, db_path):
+        raise ExportBlocked("Not all artifacts have valid signatures.")
+
+    # Verify every artifact on disk still matches the hash it was recorded under
+    artifact_dir = Path.cwd() / "artifacts"
+    try:
+        digests = sha256_many([artifact_dir / h for h in all_artifact_hashes])
+    except FileNotFoundError as e:
+        raise ExportBlocked(f"Artifact file missing: {e.filename}") from e
+    for artifact_hash, digest in zip(all_artifact_hashes, digests, strict=True):
+        if digest != artifact_hash:
+            raise ExportBlocked(f"Artifact {artifact_hash} does not match its recorded hash.")
+
+    # Collect the raw artifact files in the artifacts/ directory. scandir answers
+    # is_file() from the directory listing itself; dotfiles are in-progress captures.
+    with os.scandir(artifact_dir) as entries:
+        members = [
+            entry
+            for entry in entries
+            if entry.is_file(follow_symlinks=False) and not entry.name.startswith(".")
+        ]
+
+    # Create tarball and calculate SHA256SUMS
+    output.parent.mkdir(parents=True, exist_ok=True)
+    if sum(entry.stat().st_size for entry in members) <= _IN_MEMORY_TARBALL_LIMIT:
+        tarball_hash = _write_tarball_in_memory(output, members, compresslevel)
+    else:
+        with _open_tarball(output, compresslevel) as tar:
+            for entry in members:
+                tar.add(entry.path, arcname=f"artifacts/{entry.name}")
+        tarball_hash = sha256_file(output)
+    with open(checksums, "w") as f:
+        f.write(f"{tarball_hash} {output.name}\n")
+
+    # Generate SBOM if requested
+    sbom_output_path = None
+    if sbom:
+        sbom_output_path = get_dist_dir() / f"{output.stem}.sbom.json"
+        generate_sbom(sbom_output_path)
+
+    # Generate SLSA attestation if requested
+    slsa_output_path = None
+    if slsa:
+        slsa_output_path = get_dist_dir() / f"{output.stem}.slsa.json"
+        # Placeholder predicate for now
+        slsa_predicate = {
+            "builder": {"id": "https://example.com/builder"},
+            "buildType": "https://example.com/buildType",
+        }
+        # The tarball was just hashed for SHA256SUMS, so it isn't read again
+        generate_slsa_attestation(output, slsa_output_path, slsa_predicate, tarball_hash)
+
+    insert_event(
+        {
+            "ts": _get_timestamp(),
+            "action": "export",
+            "by": get_public_key_fingerprint(),
+            "exported_tarball": str(output),
+            "tarball_hash": tarball_hash,
+            "artifacts_exported": all_artifact_hashes,
+            "sbom_generated": sbom,
+            "slsa_generated": slsa,
+        },
+        db_path,
+    )
+
+    return {
+        "tarball_hash": tarball_hash,
+        "sbom_path": sbom_output_path,
+        "slsa_path": slsa_output_path,
+    }
@@ -1,33 +1,19 @@
-import hashlib
-import json
-import subprocess
 import sys
-import tarfile
-import uuid
-from datetime import UTC, datetime
 from pathlib import Path
 
 import click
 import yaml
 
+from kairoscope import api, serialization
+from kairoscope.api import get_dist_dir
 from kairoscope.db import (
-    get_all_artifact_hashes,
-    get_all_events,
-    get_artifact_metadata_by_hash,
+    get_all_event_json,
     get_db_path,  # Import get_db_path
     initialize_db,
-    insert_artifact_metadata,
-    insert_event,
 )
 from kairoscope.key_manager import FileKeyBackend
-from kairoscope.policy import can_export, load_policy_config
-from kairoscope.provenance import (
-    create_assertion,
-    get_public_key_fingerprint,
-    set_key_manager,
-    sign_bytes,
-)
-from kairoscope.slsa import generate_slsa_attestation
+from kairoscope.policy import get_policy_file, load_policy_config
+from kairoscope.provenance import invalidate_key_cache, set_key_manager
 from kairoscope.tpm_key_manager import TpmKeyBackend
 
 
@@ -39,16 +25,6 @@ class KairoscopeContext:
 pass_kairoscope_context = click.make_pass_decorator(KairoscopeContext, ensure=True)
 
 
-def get_dist_dir() -> Path:
-    return Path.cwd() / "dist"
-
-
-def _get_timestamp() -> str:
-    """Returns a deterministic timestamp for ledger entries."""
-    # For testing, this can be mocked. For production, it's current UTC time.
-    return datetime.now(UTC).isoformat(timespec="milliseconds").replace("+00:00", "Z")
-
-
 @click.group()
 @click.option(
     "--backend",
@@ -66,7 +42,7 @@ def cli(ctx: KairoscopeContext, backend: str):
     if backend == "file":
         set_key_manager(FileKeyBackend())
     elif backend == "tpm":
-        set_key_manager(TpmKeyBackend())
+        set_key_manager(TpmKeyBackend(db_path=ctx.db_path))
     else:
         raise click.BadParameter(f"Unknown key backend: {backend}")
 
@@ -82,50 +58,14 @@ def capture(ctx: KairoscopeContext, path_or_stdin: str | None):
     """
     Captures content from a file or stdin, creates an artifact, and records it.
     """
-    content_bytes: bytes
-    if path_or_stdin:
-        with open(path_or_stdin, "rb") as f:
-            content_bytes = f.read()
-    else:
+    if not path_or_stdin:
         click.echo("Reading from stdin... Press Ctrl+D to finish.", err=True)
-        content_bytes = sys.stdin.buffer.read()
-
-    content_hash = hashlib.sha256(content_bytes).hexdigest()
-    artifact_id = str(uuid.uuid5(uuid.NAMESPACE_URL, content_hash))
-
-    # Check if artifact already exists in DB
-    existing_artifact = get_artifact_metadata_by_hash(content_hash, ctx.db_path)
-    if existing_artifact:
-        click.echo(f"Artifact already exists: {content_hash}")
-        click.echo(f"{{'artifact': {json.dumps(existing_artifact, sort_keys=True)}}}")
-        return
-
-    # Store raw artifact content in artifacts/ directory
-    artifact_dir = Path.cwd() / "artifacts"
-    artifact_dir.mkdir(exist_ok=True)
-    artifact_path = artifact_dir / content_hash
-    with open(artifact_path, "wb") as f:
-        f.write(content_bytes)
-
-    artifact_record = {
-        "id": artifact_id,
-        "kind": "capture",
-        "uri": f"file://{content_hash}",
-        "hash": content_hash,
-    }
-    insert_artifact_metadata(artifact_record, ctx.db_path)
-
-    insert_event(
-        {
-            "ts": _get_timestamp(),
-            "action": "capture",
-            "by": get_public_key_fingerprint(),
-            "artifact_hash": content_hash,
-            "artifact_id": artifact_id,
-        },
-        ctx.db_path,
+    content_hash, artifact_json, created = api.capture(
+        Path(path_or_stdin) if path_or_stdin else None, ctx.db_path
     )
-    click.echo(f"{{'artifact': {json.dumps(artifact_record, sort_keys=True)}}}")
+    if not created:
+        click.echo(f"Artifact already exists: {content_hash}")
+    click.echo(f"{{'artifact': {artifact_json}}}")
 
 
 @cli.command()
@@ -135,36 +75,14 @@ def sign(ctx: KairoscopeContext, artifact_hash: str):
     """
     Signs an artifact record and attaches a C2PA-like assertion.
     """
-    artifact_record = get_artifact_metadata_by_hash(artifact_hash, ctx.db_path)
-    if not artifact_record:
-        click.echo(f"Error: Artifact with hash {artifact_hash} not found.", err=True)
-        raise click.Abort()
-
-    if "c2pa_assertion" in artifact_record:
+    try:
+        artifact_record, signed = api.sign(artifact_hash, ctx.db_path)
+    except ValueError as e:
+        click.echo(f"Error: {e}", err=True)
+        raise click.Abort() from e
+    if not signed:
         click.echo(f"Artifact {artifact_hash} already signed.")
-        click.echo(f"{{'artifact': {json.dumps(artifact_record, sort_keys=True)}}}")
-        return
-
-    signature = sign_bytes(artifact_hash.encode("utf-8"))
-    signature_hex = signature.hex()
-
-    assertion = create_assertion(artifact_hash, signature_hex)
-    artifact_record["c2pa_assertion"] = assertion
-
-    insert_artifact_metadata(artifact_record, ctx.db_path)  # Update the artifact record in DB
-
-    insert_event(
-        {
-            "ts": _get_timestamp(),
-            "action": "sign",
-            "by": get_public_key_fingerprint(),
-            "artifact_hash": artifact_hash,
-            "artifact_signature": signature_hex,
-            "c2pa_assertion": assertion,
-        },
-        ctx.db_path,
-    )
-    click.echo(f"{{'artifact': {json.dumps(artifact_record, sort_keys=True)}}}")
+    click.echo(f"{{'artifact': {serialization.dumps(artifact_record, sort_keys=True)}}}")
 
 
 @cli.command()
@@ -175,12 +93,13 @@ def ledger(ctx: KairoscopeContext, show: bool):
     Manages the provenance ledger.
     """
     if show:
-        events = get_all_events(ctx.db_path)
-        if not events:
+        # Events are stored as canonical JSON, so they're printed without re-encoding
+        event_jsons = get_all_event_json(ctx.db_path)
+        if not event_jsons:
             click.echo("Ledger is empty.")
             return
-        for event in events:
-            click.echo(json.dumps(event, sort_keys=True))
+        for event_json in event_jsons:
+            click.echo(event_json)
     else:
         click.echo("Use --show to display ledger contents.")
 
@@ -194,17 +113,32 @@ def key():
 
 
 @key.command("generate")
-@click.option("--curve", type=str, default="P384", help="ECC curve to use (e.g., P384).")
+@click.option(
+    "--curve",
+    type=click.Choice(["Ed25519", "P384"], case_sensitive=False),
+    default=None,
+    help="Curve to use (defaults to Ed25519 for file keys, P384 for TPM keys).",
+)
 @click.option("--label", type=str, default=None, help="Optional label for the key.")
-def key_generate(curve: str, label: str | None):
+def key_generate(curve: str | None, label: str | None):
     """
     Generates a new key pair using the active backend.
     """
     from kairoscope.provenance import get_active_key_manager
 
     manager = get_active_key_manager()
-    key_id, public_key_pem = manager.generate_key_pair(curve=curve, label=label)
-    click.echo(f"Generated key with ID: {key_id}")
+    # Backends return the existing key rather than replacing it
+    existing_key_ids = {key_info["id"] for key_info in manager.list_keys()}
+    try:
+        key_id, public_key_pem = manager.generate_key_pair(curve=curve, label=label)
+    except ValueError as e:
+        click.echo(f"Error: {e}", err=True)
+        raise click.Abort() from e
+    if key_id in existing_key_ids:
+        click.echo(f"Key already exists with ID: {key_id}")
+    else:
+        invalidate_key_cache()
+        click.echo(f"Generated key with ID: {key_id}")
     click.echo(f"Public Key PEM:\n{public_key_pem}")
 
 
@@ -221,7 +155,7 @@ def key_list():
         click.echo("No keys found for the active backend.")
         return
     for key_info in keys:
-        click.echo(json.dumps(key_info, indent=2))
+        click.echo(serialization.dumps(key_info, indent=True))
 
 
 @key.command("delete")
@@ -235,6 +169,7 @@ def key_delete(key_id: str):
     manager = get_active_key_manager()
     try:
         manager.delete_key(key_id)
+        invalidate_key_cache()  # The deleted key may have been the default signing key
         click.echo(f"Key with ID '{key_id}' deleted successfully.")
     except ValueError as e:
         click.echo(f"Error: {e}", err=True)
@@ -255,8 +190,14 @@ def policy_config():
     """
     Displays the current policy configuration.
     """
-    config = load_policy_config()
-    click.echo(yaml.dump(config, indent=2))
+    config = load_policy_config()  # Validates the policy file, or supplies the default
+    policy_file = get_policy_file()
+    if policy_file.exists():
+        # A validated file is shown as written rather than parsed and dumped again
+        policy_text = policy_file.read_text()
+        click.echo(policy_text, nl=not policy_text.endswith("\n"))
+    else:
+        click.echo(yaml.dump(config, indent=2))
 
 
 @cli.command()
@@ -287,78 +228,26 @@ def export(ctx: KairoscopeContext, output: Path, checksums: Path, sbom: bool, sl
     """
     Packages selected artifacts into a tarball and generates SHA256SUMS.
     """
-    all_artifact_hashes = get_all_artifact_hashes(ctx.db_path)
+    try:
+        result = api.export(output, checksums, ctx.db_path, sbom=sbom, slsa=slsa)
+    except api.ExportBlocked as e:
+        click.echo(f"Export blocked: {e}", err=True)
+        raise click.Abort() from e
+    except ValueError as e:  # Invalid KAIROSCOPE_TAR_COMPRESSLEVEL
+        click.echo(f"Error: {e}", err=True)
+        raise click.Abort() from e
+    except RuntimeError as e:  # Raised by SBOM generation
+        click.echo(f"Error generating SBOM for {sys.executable}: {e}", err=True)
+        raise click.Abort() from e
 
-    if not all_artifact_hashes:
+    if result is None:
         click.echo("No artifacts found to export.", err=True)
         return
-
-    if not can_export(all_artifact_hashes, ctx.db_path):
-        click.echo("Export blocked: Not all artifacts have valid signatures.", err=True)
-        raise click.Abort()
-
-    # Create tarball
-    output.parent.mkdir(parents=True, exist_ok=True)
-    with tarfile.open(output, "w:gz") as tar:
-        # Iterate over raw artifact files in the artifacts/ directory
-        artifact_dir = Path.cwd() / "artifacts"
-        for artifact_file in artifact_dir.iterdir():
-            tar.add(artifact_file, arcname=f"artifacts/{artifact_file.name}")
-
-    # Calculate SHA256SUMS
-    tarball_hash = hashlib.sha256(output.read_bytes()).hexdigest()
-    with open(checksums, "w") as f:
-        f.write(f"{tarball_hash} {output.name}\n")
-
-    # Generate SBOM if requested
-    if sbom:
-        sbom_output_path = get_dist_dir() / f"{output.stem}.sbom.json"
-        # Execute cyclonedx-bom to generate the SBOM for the project
-        # The -e . ensures it scans the current directory (project root)
-        # The output is written directly to sbom_output_path
-        command = [
-            sys.executable,
-            "-m",
-            "cyclonedx_py",
-            "environment",
-            "-o",
-            str(sbom_output_path),
-            sys.executable,  # Scan the current Python interpreter's environment
-        ]
-        click.echo(f"Generating SBOM using: {' '.join(command)}")
-        try:
-            subprocess.run(command, check=True, capture_output=True, text=True)
-            click.echo(f"Generated SBOM: {sbom_output_path}")
-        except subprocess.CalledProcessError as e:
-            click.echo(f"Error generating SBOM: {e.stderr}", err=True)
-            raise click.Abort() from e
-
-    # Generate SLSA attestation if requested
-    if slsa:
-        slsa_output_path = get_dist_dir() / f"{output.stem}.slsa.json"
-        # Placeholder predicate for now
-        slsa_predicate = {
-            "builder": {"id": "https://example.com/builder"},
-            "buildType": "https://example.com/buildType",
-        }
-        generate_slsa_attestation(output, slsa_output_path, slsa_predicate)
-        click.echo(f"Generated SLSA attestation: {slsa_output_path}")
-
-    insert_event(
-        {
-            "ts": _get_timestamp(),
-            "action": "export",
-            "by": get_public_key_fingerprint(),
-            "exported_tarball": str(output),
-            "tarball_hash": tarball_hash,
-            "artifacts_exported": all_artifact_hashes,
-            "sbom_generated": sbom,
-            "slsa_generated": slsa,
-        },
-        ctx.db_path,
-    )
-
-    click.echo(f"Exported to {output} with checksum {tarball_hash}")
+    if result["sbom_path"] is not None:
+        click.echo(f"Generated SBOM for {sys.executable}: {result['sbom_path']}")
+    if result["slsa_path"] is not None:
+        click.echo(f"Generated SLSA attestation: {result['slsa_path']}")
+    click.echo(f"Exported to {output} with checksum {result['tarball_hash']}")
 
 
 if __name__ == "__main__":
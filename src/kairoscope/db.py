@@ -1,9 +1,12 @@
-import json
+import atexit
 import os
 import sqlite3
+from collections.abc import Iterable
 from pathlib import Path
 from typing import Any
 
+from kairoscope import serialization
+
 
 def get_db_path() -> Path:
     db_path_str = os.environ.get("KAIROSCOPE_DB_PATH")
@@ -13,143 +16,359 @@ def get_db_path() -> Path:
 
 
 def get_db_connection(db_path: Path) -> sqlite3.Connection:
-    conn = sqlite3.connect(db_path)
+    # A "file:" path is opened as an SQLite URI, e.g. file:name?mode=memory&cache=shared
+    conn = sqlite3.connect(db_path, uri=str(db_path).startswith("file:"))
     conn.row_factory = sqlite3.Row  # Access columns by name
+    # WAL lets readers and the writer proceed concurrently and, with synchronous=NORMAL,
+    # only fsyncs at checkpoints instead of on every commit.
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA mmap_size=268435456")
     return conn
 
 
+# Connections are opened once per database and reused for the life of the process,
+# so a CLI invocation pays connection setup once rather than on every query.
+_connections: dict[Path, sqlite3.Connection] = {}
+
+
+def _get_connection(db_path: Path) -> sqlite3.Connection:
+    conn = _connections.get(db_path)
+    if conn is None:
+        conn = _connections[db_path] = get_db_connection(db_path)
+    return conn
+
+
+def close_db_connections() -> None:
+    """Closes all cached database connections."""
+    while _connections:
+        _, conn = _connections.popitem()
+        conn.close()
+
+
+atexit.register(close_db_connections)
+
+
+# Bump when initialize_db changes the schema; databases stamped with it skip the DDL.
+SCHEMA_VERSION = 5
+
+
 def initialize_db(db_path: Path) -> None:
-    conn = get_db_connection(db_path)
-    cursor = conn.cursor()
+    conn = _get_connection(db_path)
+    user_version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if user_version == SCHEMA_VERSION:
+        return
 
-    # Create events table
-    cursor.execute(
+    # Run the schema DDL as one transaction so it costs a single commit
+    with conn:
+        conn.execute("BEGIN")
+
+        # Create events table
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                timestamp TEXT NOT NULL,
+                action TEXT NOT NULL,
+                by TEXT NOT NULL,
+                artifact_hash TEXT,
+                artifact_id TEXT,
+                artifact_signature TEXT,
+                c2pa_assertion TEXT,
+                exported_tarball TEXT,
+                tarball_hash TEXT,
+                artifacts_exported TEXT, -- Stored as JSON string
+                sbom_generated INTEGER, -- Boolean (0 or 1)
+                slsa_generated INTEGER, -- Boolean (0 or 1)
+                raw_event_json TEXT NOT NULL -- Original event JSON for flexibility
+            )
         """
-        CREATE TABLE IF NOT EXISTS events (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp TEXT NOT NULL,
-            action TEXT NOT NULL,
-            by TEXT NOT NULL,
-            artifact_hash TEXT,
-            artifact_id TEXT,
-            artifact_signature TEXT,
-            c2pa_assertion TEXT,
-            exported_tarball TEXT,
-            tarball_hash TEXT,
-            artifacts_exported TEXT, -- Stored as JSON string
-            sbom_generated INTEGER, -- Boolean (0 or 1)
-            slsa_generated INTEGER, -- Boolean (0 or 1)
-            raw_event_json TEXT NOT NULL -- Original event JSON for flexibility
         )
-    """
-    )
 
-    # Create artifacts table
-    cursor.execute(
+        # Create artifacts table
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS artifacts (
+                id TEXT PRIMARY KEY, -- artifact_id (UUID)
+                kind TEXT NOT NULL,
+                uri TEXT NOT NULL,
+                hash TEXT UNIQUE NOT NULL,
+                c2pa_assertion TEXT,
+                raw_metadata_json TEXT NOT NULL -- Original artifact metadata JSON for flexibility
+            )
         """
-        CREATE TABLE IF NOT EXISTS artifacts (
-            id TEXT PRIMARY KEY, -- artifact_id (UUID)
-            kind TEXT NOT NULL,
-            uri TEXT NOT NULL,
-            hash TEXT UNIQUE NOT NULL,
-            c2pa_assertion TEXT,
-            raw_metadata_json TEXT NOT NULL -- Original artifact metadata JSON for flexibility
         )
-    """
-    )
 
-    conn.commit()
-    conn.close()
+        # Rows from before schema 5 hold json.dumps output, with spaces and unsorted keys.
+        # They are re-encoded as insert_event writes them, so every stored event is canonical.
+        if user_version < 5:
+            rows = conn.execute("SELECT id, raw_event_json FROM events").fetchall()
+            conn.executemany(
+                "UPDATE events SET raw_event_json = ? WHERE id = ?",
+                [
+                    (serialization.dumps(serialization.loads(raw_json), sort_keys=True), row_id)
+                    for row_id, raw_json in rows
+                ],
+            )
 
+        # Maps captured source files to their content hash, keyed by path and validated by
+        # mtime, size, ctime and inode, so recapturing an unchanged file doesn't need to
+        # re-hash it. The table is only a cache, so one from before schema 4, without the
+        # ctime and inode columns, is dropped rather than migrated.
+        if user_version < 4:
+            conn.execute("DROP TABLE IF EXISTS artifacts_pathcache")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS artifacts_pathcache (
+                path TEXT PRIMARY KEY,
+                mtime_ns INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                ctime_ns INTEGER NOT NULL,
+                inode INTEGER NOT NULL,
+                hash TEXT NOT NULL
+            )
+        """
+        )
 
-def insert_event(event: dict[str, Any], db_path: Path) -> None:
-    conn = get_db_connection(db_path)
-    cursor = conn.cursor()
-    cursor.execute(
+        # Keys held by the TPM backend, so a key is found by ID without scanning TPM handles
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS tpm_keys (
+                key_id TEXT PRIMARY KEY, -- Public key fingerprint
+                persistent_handle INTEGER UNIQUE NOT NULL,
+                label TEXT UNIQUE NOT NULL,
+                algorithm TEXT NOT NULL,
+                pem BLOB NOT NULL -- Public key PEM
+            )
         """
-        INSERT INTO events (
-            timestamp, action, by, artifact_hash, artifact_id, artifact_signature,
-            c2pa_assertion, exported_tarball, tarball_hash, artifacts_exported,
-            sbom_generated, slsa_generated, raw_event_json
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """,
-        (
-            event.get("ts"),
-            event.get("action"),
-            event.get("by"),
-            event.get("artifact_hash"),
-            event.get("artifact_id"),
-            event.get("artifact_signature"),
-            event.get("c2pa_assertion"),
-            event.get("exported_tarball"),
-            event.get("tarball_hash"),
-            (
-                json.dumps(event.get("artifacts_exported"))
-                if event.get("artifacts_exported")
-                else None
-            ),
-            int(event.get("sbom_generated", False)),
-            int(event.get("slsa_generated", False)),
-            json.dumps(event),
-        ),
+        )
+
+        # Indexes: hash lookups are answered from the covering index alone, and the ledger
+        # is read in timestamp order without a sort.
+        indexes_exist = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_events_ts'"
+        ).fetchone()
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_artifacts_hash_cover "
+            "ON artifacts(hash, raw_metadata_json)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_events_ts ON events(timestamp)")
+        if not indexes_exist:
+            conn.execute("ANALYZE")
+
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+
+_INSERT_EVENT_SQL = """
+    INSERT INTO events (
+        timestamp, action, by, artifact_hash, artifact_id, artifact_signature,
+        c2pa_assertion, exported_tarball, tarball_hash, artifacts_exported,
+        sbom_generated, slsa_generated, raw_event_json
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+
+# Event keys stored verbatim in their own columns, in INSERT order.
+_EVENT_COLUMN_KEYS = (
+    "ts",
+    "action",
+    "by",
+    "artifact_hash",
+    "artifact_id",
+    "artifact_signature",
+    "c2pa_assertion",
+    "exported_tarball",
+    "tarball_hash",
+)
+
+
+def _event_row(event: dict[str, Any]) -> tuple[Any, ...]:
+    get = event.get  # Bound once; the column values are then read in a single C-level map
+    artifacts_exported = get("artifacts_exported")
+    return (
+        *map(get, _EVENT_COLUMN_KEYS),
+        serialization.dumps(artifacts_exported) if artifacts_exported else None,
+        int(get("sbom_generated", False)),
+        int(get("slsa_generated", False)),
+        serialization.dumps(event, sort_keys=True),
     )
-    conn.commit()
-    conn.close()
+
+
+def insert_event(event: dict[str, Any], db_path: Path) -> None:
+    conn = _get_connection(db_path)
+    with conn:
+        conn.execute(_INSERT_EVENT_SQL, _event_row(event))
+
+
+def insert_events_bulk(events: Iterable[dict[str, Any]], db_path: Path) -> None:
+    """Inserts several events in a single transaction, so they share one commit."""
+    conn = _get_connection(db_path)
+    with conn:
+        conn.executemany(_INSERT_EVENT_SQL, map(_event_row, events))
+
+
+def get_all_event_json(db_path: Path) -> list[str]:
+    """Returns the stored JSON of every event, in timestamp order, as canonical sorted-key text."""
+    conn = _get_connection(db_path)
+    cursor = conn.execute("SELECT raw_event_json FROM events ORDER BY timestamp ASC")
+    return [row[0] for row in cursor]
 
 
 def get_all_events(db_path: Path) -> list[dict[str, Any]]:
-    conn = get_db_connection(db_path)
-    cursor = conn.cursor()
-    cursor.execute("SELECT raw_event_json FROM events ORDER BY timestamp ASC")
-    events = [json.loads(row["raw_event_json"]) for row in cursor.fetchall()]
-    conn.close()
-    return events
+    conn = _get_connection(db_path)
+    cursor = conn.execute("SELECT raw_event_json FROM events ORDER BY timestamp ASC")
+    # Rows are decoded straight off the cursor by position, without an intermediate list
+    return [serialization.loads(row[0]) for row in cursor]
+
+
+def get_sign_events(artifact_hashes: list[str], db_path: Path) -> list[tuple[str, str, str | None]]:
+    """
+    Returns (artifact_hash, artifact_signature, by) for every sign event on one of the given
+    artifacts that records a signature, read from their columns without decoding the events.
+    """
+    conn = _get_connection(db_path)
+    cursor = conn.execute(
+        "SELECT artifact_hash, artifact_signature, by FROM events "
+        "WHERE action = 'sign' AND artifact_signature != '' "
+        "AND artifact_hash IN (SELECT value FROM json_each(?))",
+        (serialization.dumps(artifact_hashes),),
+    )
+    return [tuple(row) for row in cursor]
+
+
+_INSERT_ARTIFACT_SQL = """
+    INSERT OR REPLACE INTO artifacts (
+        id, kind, uri, hash, c2pa_assertion, raw_metadata_json
+    ) VALUES (?, ?, ?, ?, ?, ?)
+"""
+
+
+def _artifact_row(metadata: dict[str, Any]) -> tuple[Any, ...]:
+    return (
+        metadata.get("id"),
+        metadata.get("kind"),
+        metadata.get("uri"),
+        metadata.get("hash"),
+        metadata.get("c2pa_assertion"),
+        serialization.dumps(metadata, sort_keys=True),
+    )
 
 
 def insert_artifact_metadata(metadata: dict[str, Any], db_path: Path) -> None:
-    conn = get_db_connection(db_path)
-    cursor = conn.cursor()
-    cursor.execute(
-        """
-        INSERT OR REPLACE INTO artifacts (
-            id, kind, uri, hash, c2pa_assertion, raw_metadata_json
-        ) VALUES (?, ?, ?, ?, ?, ?)
-    """,
-        (
-            metadata.get("id"),
-            metadata.get("kind"),
-            metadata.get("uri"),
-            metadata.get("hash"),
-            metadata.get("c2pa_assertion"),
-            json.dumps(metadata),
-        ),
+    conn = _get_connection(db_path)
+    with conn:
+        conn.execute(_INSERT_ARTIFACT_SQL, _artifact_row(metadata))
+
+
+def insert_artifact_metadata_bulk(metadata_rows: Iterable[dict[str, Any]], db_path: Path) -> None:
+    """Inserts or replaces several artifacts in a single transaction, so they share one commit."""
+    conn = _get_connection(db_path)
+    with conn:
+        conn.executemany(_INSERT_ARTIFACT_SQL, map(_artifact_row, metadata_rows))
+
+
+def get_artifact_json_by_hash(artifact_hash: str, db_path: Path) -> str | None:
+    """
+    Returns the stored metadata JSON for an artifact. Lookups aren't memoized: another process
+    can write the row at any time, and the covering index already answers without a table fetch.
+    """
+    conn = _get_connection(db_path)
+    # The UNIQUE autoindex on hash would otherwise win and force a table row fetch.
+    cursor = conn.execute(
+        "SELECT raw_metadata_json FROM artifacts INDEXED BY idx_artifacts_hash_cover "
+        "WHERE hash = ?",
+        (artifact_hash,),
     )
-    conn.commit()
-    conn.close()
+    row = cursor.fetchone()
+    return row["raw_metadata_json"] if row else None
 
 
 def get_artifact_metadata_by_hash(artifact_hash: str, db_path: Path) -> dict[str, Any] | None:
-    conn = get_db_connection(db_path)
-    cursor = conn.cursor()
-    cursor.execute("SELECT raw_metadata_json FROM artifacts WHERE hash = ?", (artifact_hash,))
-    row = cursor.fetchone()
-    conn.close()
-    return json.loads(row["raw_metadata_json"]) if row else None
+    # Each call decodes a fresh dict from the row, so callers are free to modify it.
+    raw_metadata_json = get_artifact_json_by_hash(artifact_hash, db_path)
+    return serialization.loads(raw_metadata_json) if raw_metadata_json is not None else None
 
 
 def get_artifact_metadata_by_id(artifact_id: str, db_path: Path) -> dict[str, Any] | None:
-    conn = get_db_connection(db_path)
-    cursor = conn.cursor()
-    cursor.execute("SELECT raw_metadata_json FROM artifacts WHERE id = ?", (artifact_id,))
+    conn = _get_connection(db_path)
+    cursor = conn.execute("SELECT raw_metadata_json FROM artifacts WHERE id = ?", (artifact_id,))
     row = cursor.fetchone()
-    conn.close()
-    return json.loads(row["raw_metadata_json"]) if row else None
+    return serialization.loads(row["raw_metadata_json"]) if row else None
 
 
 def get_all_artifact_hashes(db_path: Path) -> list[str]:
-    conn = get_db_connection(db_path)
-    cursor = conn.cursor()
-    cursor.execute("SELECT hash FROM artifacts")
-    hashes = [row["hash"] for row in cursor.fetchall()]
-    conn.close()
-    return hashes
+    conn = _get_connection(db_path)
+    return [row[0] for row in conn.execute("SELECT hash FROM artifacts")]
+
+
+def count_unsigned_artifacts(artifact_hashes: list[str], db_path: Path) -> int:
+    """Counts how many of the given artifacts have no recorded c2pa_assertion."""
+    conn = _get_connection(db_path)
+    # json_each takes the whole list as one parameter, avoiding SQLite's variable limit.
+    row = conn.execute(
+        "SELECT COUNT(*) FROM artifacts WHERE c2pa_assertion IS NULL "
+        "AND hash IN (SELECT value FROM json_each(?))",
+        (serialization.dumps(artifact_hashes),),
+    ).fetchone()
+    return row[0]
+
+
+def get_cached_path_hash(
+    path: str, mtime_ns: int, size: int, ctime_ns: int, inode: int, db_path: Path
+) -> str | None:
+    """Returns the hash recorded for path, provided its mtime, size, ctime and inode match."""
+    conn = _get_connection(db_path)
+    row = conn.execute(
+        "SELECT hash FROM artifacts_pathcache "
+        "WHERE path = ? AND mtime_ns = ? AND size = ? AND ctime_ns = ? AND inode = ?",
+        (path, mtime_ns, size, ctime_ns, inode),
+    ).fetchone()
+    return row[0] if row else None
+
+
+def cache_path_hash(
+    path: str,
+    mtime_ns: int,
+    size: int,
+    ctime_ns: int,
+    inode: int,
+    artifact_hash: str,
+    db_path: Path,
+) -> None:
+    conn = _get_connection(db_path)
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO artifacts_pathcache "
+            "(path, mtime_ns, size, ctime_ns, inode, hash) VALUES (?, ?, ?, ?, ?, ?)",
+            (path, mtime_ns, size, ctime_ns, inode, artifact_hash),
+        )
+
+
+def insert_tpm_key(
+    key_id: str, persistent_handle: int, label: str, algorithm: str, pem: bytes, db_path: Path
+) -> None:
+    conn = _get_connection(db_path)
+    with conn:
+        conn.execute(
+            "INSERT INTO tpm_keys (key_id, persistent_handle, label, algorithm, pem) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (key_id, persistent_handle, label, algorithm, pem),
+        )
+
+
+def get_tpm_key(key_id: str, db_path: Path) -> dict[str, Any] | None:
+    conn = _get_connection(db_path)
+    row = conn.execute("SELECT * FROM tpm_keys WHERE key_id = ?", (key_id,)).fetchone()
+    return dict(row) if row else None
+
+
+def get_all_tpm_keys(db_path: Path) -> list[dict[str, Any]]:
+    conn = _get_connection(db_path)
+    return [dict(row) for row in conn.execute("SELECT * FROM tpm_keys ORDER BY persistent_handle")]
+
+
+def delete_tpm_key(key_id: str, db_path: Path) -> None:
+    conn = _get_connection(db_path)
+    with conn:
+        conn.execute("DELETE FROM tpm_keys WHERE key_id = ?", (key_id,))
@@ -1,11 +1,19 @@
+import functools
+import hashlib
 from abc import ABC, abstractmethod
+from collections.abc import Callable
 from pathlib import Path
 
 from cryptography.hazmat.primitives import hashes, serialization
-from cryptography.hazmat.primitives.asymmetric import ec, padding, rsa
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, padding, rsa
 from cryptography.hazmat.primitives.asymmetric.types import PrivateKeyTypes, PublicKeyTypes
 
 
+def _sha256(data: bytes) -> str:
+    """One-shot SHA256 hex digest, for small buffers such as encoded public keys."""
+    return hashlib.sha256(data).hexdigest()
+
+
 class KeyManager(ABC):
     """
     Abstract Base Class for managing cryptographic keys.
@@ -13,9 +21,12 @@ class KeyManager(ABC):
     """
 
     @abstractmethod
-    def generate_key_pair(self, curve: str = "P384", label: str | None = None) -> tuple[str, str]:
+    def generate_key_pair(
+        self, curve: str | None = None, label: str | None = None
+    ) -> tuple[str, str]:
         """
-        Generates a new ECC key pair (P-384 by default) within the backend.
+        Generates a new key pair on the given curve (e.g., "P384"), or the backend's default
+        curve if none is given. Raises ValueError for curves the backend doesn't support.
         Returns a tuple of (key_id, public_key_pem).
         The key_id is a unique identifier for the key within the backend.
         """
@@ -51,6 +62,13 @@ class KeyManager(ABC):
         """
         pass
 
+    def sign_many(self, key_id: str, digests: list[bytes]) -> list[bytes]:
+        """
+        Signs several pre-hashed digests with the same key, in order.
+        Backends can override this to reuse per-key signing state across the batch.
+        """
+        return [self.sign_digest(key_id, digest) for digest in digests]
+
     @abstractmethod
     def verify_signature(self, key_id: str, signature: bytes, digest: bytes) -> bool:
         """
@@ -58,6 +76,13 @@ class KeyManager(ABC):
         """
         pass
 
+    def get_verifier(self, key_id: str) -> Callable[[bytes, bytes], bool]:
+        """
+        Returns a function that verifies (signature, digest) pairs against key_id's public key.
+        Backends can override this to resolve the key and algorithm once for many verifications.
+        """
+        return functools.partial(self.verify_signature, key_id)
+
     @abstractmethod
     def get_algorithm(self, key_id: str) -> str:
         """
@@ -83,6 +108,11 @@ class KeyManager(ABC):
 
 KEY_PASSWORD = None  # For simplicity in v0.1; use env var or KMS in production.
 
+# Curves FileKeyBackend generates keys on. Ed25519 is the default: small keys, and signing
+# and verification are several times faster than ECDSA P-384.
+FILE_KEY_CURVES = ("Ed25519", "P384")
+DEFAULT_FILE_KEY_CURVE = "Ed25519"
+
 
 class FileKeyBackend(KeyManager):
     """
@@ -94,6 +124,9 @@ class FileKeyBackend(KeyManager):
         self._private_key: PrivateKeyTypes | None = None
         self._public_key: PublicKeyTypes | None = None
         self._key_id: str | None = None  # The fingerprint of the managed key
+        self._public_pem: str | None = None
+        # Signature algorithm objects are stateless, so build them once per instance.
+        self._ecdsa_sha256 = ec.ECDSA(hashes.SHA256())
 
     def _get_private_key_path(self) -> Path:
         return self.key_dir / "kairoscope.key"
@@ -101,9 +134,9 @@ class FileKeyBackend(KeyManager):
     def _get_public_key_path(self) -> Path:
         return self.key_dir / "kairoscope.pub"
 
-    def _load_or_generate_keypair(self) -> PrivateKeyTypes:
+    def _load_or_generate_keypair(self, curve: str = DEFAULT_FILE_KEY_CURVE) -> PrivateKeyTypes:
         """
-        Loads an existing private key or generates a new one.
+        Loads an existing private key or generates a new one on curve.
         Sets self._key_id to the fingerprint of the loaded/generated key.
         """
         if self._private_key:
@@ -118,8 +151,13 @@ class FileKeyBackend(KeyManager):
                     f.read(), password=KEY_PASSWORD
                 )
         else:
-            # Using ECC for smaller key sizes and good performance.
-            self._private_key = ec.generate_private_key(ec.SECP384R1())
+            # Existing key files are loaded as-is, whatever their type
+            if curve == "Ed25519":
+                self._private_key = ed25519.Ed25519PrivateKey.generate()
+            elif curve == "P384":
+                self._private_key = ec.generate_private_key(ec.SECP384R1())
+            else:
+                raise ValueError(f"Unsupported curve for file keys: {curve}")
             pem = self._private_key.private_bytes(
                 encoding=serialization.Encoding.PEM,
                 format=serialization.PrivateFormat.PKCS8,
@@ -141,19 +179,26 @@ class FileKeyBackend(KeyManager):
         return self._private_key
 
     def _calculate_fingerprint_from_public_key(self, public_key: PublicKeyTypes) -> str:
-        """Helper to calculate fingerprint from a public key object."""
+        """
+        Helper to calculate fingerprint from a public key object.
+        Called once per loaded key; the result is kept as self._key_id.
+        """
         der_bytes = public_key.public_bytes(
             encoding=serialization.Encoding.DER,
             format=serialization.PublicFormat.SubjectPublicKeyInfo,
         )
-        digest = hashes.Hash(hashes.SHA256())
-        digest.update(der_bytes)
-        return f"sha256:{digest.finalize().hex()}"
+        return f"sha256:{_sha256(der_bytes)}"
 
-    def generate_key_pair(self, curve: str = "P384", label: str | None = None) -> tuple[str, str]:
+    def generate_key_pair(
+        self, curve: str | None = None, label: str | None = None
+    ) -> tuple[str, str]:
         # For FileKeyBackend, we only manage one key pair for now.
         # This method will ensure it exists and return its details.
-        self._load_or_generate_keypair()  # Ensure key is loaded/generated and _key_id is set
+        curve = curve or DEFAULT_FILE_KEY_CURVE
+        if curve not in FILE_KEY_CURVES:
+            raise ValueError(f"Unsupported curve for file keys: {curve}")
+        # Ensure key is loaded/generated and _key_id is set
+        self._load_or_generate_keypair(curve)
         if self._key_id is None:
             raise RuntimeError("Key ID not set after loading/generating key pair.")
         key_id = self._key_id
@@ -164,14 +209,19 @@ class FileKeyBackend(KeyManager):
         private_key = self._load_or_generate_keypair()
         if self._key_id != key_id:
             raise ValueError(f"Key with ID {key_id} not managed by this FileKeyBackend instance.")
-        return private_key.public_key()
+        if self._public_key is None:
+            self._public_key = private_key.public_key()
+        return self._public_key
 
     def get_public_key_pem(self, key_id: str) -> str:
         public_key = self.get_public_key(key_id)
-        return public_key.public_bytes(
-            encoding=serialization.Encoding.PEM,
-            format=serialization.PublicFormat.SubjectPublicKeyInfo,
-        ).decode("utf-8")
+        # The key never changes for this instance, so encode the PEM only once.
+        if self._public_pem is None:
+            self._public_pem = public_key.public_bytes(
+                encoding=serialization.Encoding.PEM,
+                format=serialization.PublicFormat.SubjectPublicKeyInfo,
+            ).decode("utf-8")
+        return self._public_pem
 
     def get_public_key_fingerprint(self, key_id: str) -> str:
         # For FileKeyBackend, the key_id IS the fingerprint
@@ -183,8 +233,10 @@ class FileKeyBackend(KeyManager):
         private_key = self._load_or_generate_keypair()
         if self._key_id != key_id:
             raise ValueError(f"Key with ID {key_id} not managed by this FileKeyBackend instance.")
-        if isinstance(private_key, ec.EllipticCurvePrivateKey):
-            return private_key.sign(digest, ec.ECDSA(hashes.SHA256()))
+        if isinstance(private_key, ed25519.Ed25519PrivateKey):
+            return private_key.sign(digest)
+        elif isinstance(private_key, ec.EllipticCurvePrivateKey):
+            return private_key.sign(digest, self._ecdsa_sha256)
         elif isinstance(private_key, rsa.RSAPrivateKey):
             return private_key.sign(
                 digest,
@@ -193,11 +245,25 @@ class FileKeyBackend(KeyManager):
             )
         raise TypeError("Unsupported private key type for signing")
 
+    def sign_many(self, key_id: str, digests: list[bytes]) -> list[bytes]:
+        private_key = self._load_or_generate_keypair()
+        if self._key_id != key_id:
+            raise ValueError(f"Key with ID {key_id} not managed by this FileKeyBackend instance.")
+        if isinstance(private_key, ed25519.Ed25519PrivateKey):
+            sign_ed25519 = private_key.sign
+            return [sign_ed25519(digest) for digest in digests]
+        if isinstance(private_key, ec.EllipticCurvePrivateKey):
+            sign, algorithm = private_key.sign, self._ecdsa_sha256
+            return [sign(digest, algorithm) for digest in digests]
+        return super().sign_many(key_id, digests)
+
     def verify_signature(self, key_id: str, signature: bytes, digest: bytes) -> bool:
         public_key = self.get_public_key(key_id)
         try:
-            if isinstance(public_key, ec.EllipticCurvePublicKey):
-                public_key.verify(signature, digest, ec.ECDSA(hashes.SHA256()))
+            if isinstance(public_key, ed25519.Ed25519PublicKey):
+                public_key.verify(signature, digest)
+            elif isinstance(public_key, ec.EllipticCurvePublicKey):
+                public_key.verify(signature, digest, self._ecdsa_sha256)
             elif isinstance(public_key, rsa.RSAPublicKey):
                 public_key.verify(
                     signature,
@@ -213,11 +279,40 @@ class FileKeyBackend(KeyManager):
         except Exception:
             return False
 
+    def get_verifier(self, key_id: str) -> Callable[[bytes, bytes], bool]:
+        # Dispatch on the key type once; the returned closure goes straight to OpenSSL.
+        public_key = self.get_public_key(key_id)
+        if isinstance(public_key, ed25519.Ed25519PublicKey):
+            verify_ed25519 = public_key.verify
+
+            def verify(signature: bytes, digest: bytes) -> bool:
+                try:
+                    verify_ed25519(signature, digest)
+                except Exception:
+                    return False
+                return True
+
+        elif isinstance(public_key, ec.EllipticCurvePublicKey):
+            verify_ecdsa, algorithm = public_key.verify, self._ecdsa_sha256
+
+            def verify(signature: bytes, digest: bytes) -> bool:
+                try:
+                    verify_ecdsa(signature, digest, algorithm)
+                except Exception:
+                    return False
+                return True
+
+        else:
+            return super().get_verifier(key_id)
+        return verify
+
     def get_algorithm(self, key_id: str) -> str:
         private_key = self._load_or_generate_keypair()
         if self._key_id != key_id:
             raise ValueError(f"Key with ID {key_id} not managed by this FileKeyBackend instance.")
-        if isinstance(private_key, ec.EllipticCurvePrivateKey):
+        if isinstance(private_key, ed25519.Ed25519PrivateKey):
+            return "EdDSA"
+        elif isinstance(private_key, ec.EllipticCurvePrivateKey):
             return "ES384"  # Assuming P384 for ECC
         elif isinstance(private_key, rsa.RSAPrivateKey):
             return "PS256"  # Assuming RSA PSS with SHA256
@@ -226,15 +321,21 @@ class FileKeyBackend(KeyManager):
     def list_keys(self) -> list[dict[str, str]]:
         private_key_path = self._get_private_key_path()
         if private_key_path.exists():
-            self._load_or_generate_keypair()  # Ensure key is loaded/generated and _key_id is set
+            private_key = self._load_or_generate_keypair()  # Ensure _key_id is set
             if self._key_id is None:
                 raise RuntimeError("Key ID not set after loading/generating key pair.")
             key_id = self._key_id
+            if isinstance(private_key, ed25519.Ed25519PrivateKey):
+                key_type = "Ed25519"
+            elif isinstance(private_key, rsa.RSAPrivateKey):
+                key_type = "RSA"
+            else:
+                key_type = "ECC"
             return [
                 {
                     "id": key_id,
                     "label": "default-file-key",
-                    "type": "ECC",  # Assuming ECC for now
+                    "type": key_type,
                     "backend": "file",
                     "public_key_pem": self.get_public_key_pem(key_id),
                 }
@@ -256,3 +357,4 @@ class FileKeyBackend(KeyManager):
         self._private_key = None
         self._public_key = None
         self._key_id = None
+        self._public_pem = None
@@ -1,11 +1,28 @@
+import copy
+import functools
+import hashlib
+import os
 from collections import defaultdict
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Any
 
 import jsonschema
 import yaml
+from jsonschema.protocols import Validator
 
-from kairoscope.db import get_all_events
-from kairoscope.provenance import get_public_key, verify_signature
+from kairoscope.db import count_unsigned_artifacts, get_sign_events
+from kairoscope.provenance import (
+    get_default_verifier,
+    get_public_key_fingerprint,
+    verify_digest,
+)
+
+try:
+    from yaml import CSafeLoader as _YamlLoader
+except ImportError:  # PyYAML built without libyaml
+    from yaml import SafeLoader as _YamlLoader
 
 ONTOLOGY_SCHEMA_FILE = Path(__file__).parent.parent.parent / "ontology" / "kairoscope.schema.yaml"
 
@@ -14,6 +31,32 @@ def get_policy_file() -> Path:
     return Path.cwd() / "policy.yaml"
 
 
+@functools.lru_cache(maxsize=16)
+def _load_yaml_cached(path_str: str, mtime_ns: int, size: int) -> Any:
+    """
+    Parses a YAML file, memoized by path, modification time and size so edits are picked up,
+    including rewrites that land within the filesystem's timestamp granularity.
+    """
+    with open(path_str) as f:
+        return yaml.load(f, Loader=_YamlLoader)
+
+
+@functools.lru_cache(maxsize=4)
+def _compiled_validator(schema_path_str: str, mtime_ns: int, size: int) -> Validator:
+    """Returns a validator for the ontology's Policy schema, built and checked once per schema version."""
+    schema = _load_yaml_cached(schema_path_str, mtime_ns, size)["properties"]["Policy"]
+    # The ontology is written against draft 2020-12; the Policy subschema doesn't restate it
+    jsonschema.Draft202012Validator.check_schema(schema)
+    return jsonschema.Draft202012Validator(schema)
+
+
+def _policy_validator() -> Validator:
+    schema_stat = ONTOLOGY_SCHEMA_FILE.stat()
+    return _compiled_validator(
+        str(ONTOLOGY_SCHEMA_FILE), schema_stat.st_mtime_ns, schema_stat.st_size
+    )
+
+
 def load_policy_config() -> dict:
     """Loads the policy configuration from policy.yaml and validates it against the schema."""
     policy_file = get_policy_file()
@@ -27,90 +70,140 @@ def load_policy_config() -> dict:
             "threshold_rules": [],
         }
         # Validate default policy against schema
-        with open(ONTOLOGY_SCHEMA_FILE) as f:
-            schema = yaml.safe_load(f)
-        jsonschema.validate(instance=default_policy, schema=schema["properties"]["Policy"])
+        _policy_validator().validate(default_policy)
         return default_policy
 
-    with open(policy_file) as f:
-        policy_config = yaml.safe_load(f)
+    # The parsed file is shared through the cache, so callers get their own copy
+    policy_stat = policy_file.stat()
+    policy_config = copy.deepcopy(
+        _load_yaml_cached(str(policy_file), policy_stat.st_mtime_ns, policy_stat.st_size)
+    )
 
     # Validate loaded policy against schema
-    with open(ONTOLOGY_SCHEMA_FILE) as f:
-        schema = yaml.safe_load(f)
-    jsonschema.validate(instance=policy_config, schema=schema["properties"]["Policy"])
+    _policy_validator().validate(policy_config)
 
     return policy_config
 
 
-def check_existential_rule(artifact_hashes: list[str], rule: dict, db_path: Path) -> bool:
+@functools.lru_cache(maxsize=4096)
+def _artifact_hash_digest(artifact_hash: str) -> bytes:
+    """Returns the SHA-256 digest that signatures over artifact_hash are made on, once per hash."""
+    return hashlib.sha256(artifact_hash.encode("utf-8")).digest()
+
+
+@functools.lru_cache(maxsize=4096)
+def _verify_cached(signature_hex: str, artifact_hash: str, signer_fingerprint: str) -> bool:
+    """
+    Verifies an artifact signature, memoized so each unique signature is checked once across rules.
+    signer_fingerprint identifies the verifying key, keeping results from carrying over to another key.
+    A signature that isn't valid hex counts as an invalid signature.
+    """
+    try:
+        signature = bytes.fromhex(signature_hex)
+    except (TypeError, ValueError):
+        return False
+    return verify_digest(signature, _artifact_hash_digest(artifact_hash))
+
+
+# artifact_hash -> attestor_id ('by' fingerprint, None if absent) -> count of valid signatures
+SignatureIndex = Mapping[str, Mapping[str | None, int]]
+
+
+# Below this many sign events, thread pool startup outweighs verifying in parallel.
+PARALLEL_VERIFY_MIN_SIGNATURES = 16
+
+
+def _build_signature_index(
+    signatures: list[tuple[str, str, str | None]], signer_fingerprint: str, witnesses_needed: int
+) -> SignatureIndex:
+    """
+    Verifies (artifact_hash, signature_hex, attestor_id) sign records and tallies the valid
+    signatures per artifact and attestor, so all policy rules can be evaluated from a single
+    pass over the ledger.
+    Once an artifact has witnesses_needed valid signatures, only the first valid signature of
+    each further attestor is verified. Rules never need more than that, so the capped counts
+    decide them exactly as full counts would.
+    OpenSSL releases the GIL during signature verification, so larger ledgers are verified on a
+    thread pool, one artifact per task.
+    """
+    signatures_by_artifact: defaultdict[str, list[tuple[str, str | None]]] = defaultdict(list)
+    for artifact_hash, signature_hex, attestor_id in signatures:
+        # 'by' field stores the public key fingerprint
+        signatures_by_artifact[artifact_hash].append(
+            (signature_hex, attestor_id if isinstance(attestor_id, str) else None)
+        )
+
+    def tally(artifact_hash: str) -> dict[str | None, int]:
+        counts: dict[str | None, int] = {}
+        total = 0
+        for signature_hex, attestor_id in signatures_by_artifact[artifact_hash]:
+            if total >= witnesses_needed and attestor_id in counts:
+                continue
+            if _verify_cached(signature_hex, artifact_hash, signer_fingerprint):
+                counts[attestor_id] = counts.get(attestor_id, 0) + 1
+                total += 1
+        return counts
+
+    if len(signatures) >= PARALLEL_VERIFY_MIN_SIGNATURES and len(signatures_by_artifact) > 1:
+        # The verifier is resolved here rather than by the first worker, since the key
+        # backend may read its key through this thread's database connection
+        get_default_verifier()
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+            results = list(executor.map(tally, signatures_by_artifact))
+    else:
+        results = [tally(artifact_hash) for artifact_hash in signatures_by_artifact]
+
+    # The universal rule treats any artifact in the index as signed, so unsigned ones are left out
+    return {
+        artifact_hash: counts
+        for artifact_hash, counts in zip(signatures_by_artifact, results, strict=True)
+        if counts
+    }
+
+
+def check_existential_rule(
+    artifact_hashes: list[str], rule: dict, signature_index: SignatureIndex
+) -> bool:
     """
     Enforces the existential rule: export is permitted only if >= min_witnesses valid signatures
     exist for each artifact in the provided set.
     """
     min_witnesses = rule.get("min_witnesses", 1)
-    public_key = get_public_key()
-    events = get_all_events(db_path)
-
-    artifact_signatures_count: defaultdict[str, int] = defaultdict(int)
-
-    for event in events:
-        if event.get("action") == "sign":
-            artifact_hash = event.get("artifact_hash")
-            artifact_signature_hex = event.get("artifact_signature")
-            if artifact_hash and artifact_signature_hex:
-                artifact_signature = bytes.fromhex(artifact_signature_hex)
-                is_valid = verify_signature(
-                    artifact_signature, artifact_hash.encode("utf-8"), public_key
-                )
-                if is_valid:
-                    artifact_signatures_count[artifact_hash] += 1
 
     for h in artifact_hashes:
-        if artifact_signatures_count[h] < min_witnesses:
+        if sum(signature_index.get(h, {}).values()) < min_witnesses:
             return False
     return True
 
 
-def check_universal_rule(artifact_hashes: list[str], rule: dict, db_path: Path) -> bool:
+def check_universal_rule(
+    artifact_hashes: list[str], rule: dict, signature_index: SignatureIndex
+) -> bool:
     """
     Enforces the Universal rule: all specified validators must pass for each artifact.
     For now, focuses on 'signature' and 'ledger' (absence of refutation).
     """
     required_validators = rule.get("required_validators", [])
-    public_key = get_public_key()
-    events = get_all_events(db_path)
-
-    # Collect valid signatures for each artifact
-    signed_artifacts = set()
-    for event in events:
-        if event.get("action") == "sign":
-            artifact_hash = event.get("artifact_hash")
-            artifact_signature_hex = event.get("artifact_signature")
-            if artifact_hash and artifact_signature_hex:
-                artifact_signature = bytes.fromhex(artifact_signature_hex)
-                is_valid = verify_signature(
-                    artifact_signature, artifact_hash.encode("utf-8"), public_key
-                )
-                if is_valid:
-                    signed_artifacts.add(artifact_hash)
+
+    # Placeholder for 'ledger' (absence of refutation)
+    # For now, assume no refutation events exist.
+    # Future: check for 'refute' events for each artifact_hash
+    if "ledger" in required_validators and artifact_hashes:
+        # For the purpose of this test, if 'ledger' is required and no refutation logic is implemented,
+        # we consider it as not met, causing the universal rule to fail.
+        # A proper implementation would check for actual ledger validation/refutation events.
+        return False
 
     for h in artifact_hashes:
-        if "signature" in required_validators and h not in signed_artifacts:
-            return False
-        # Placeholder for 'ledger' (absence of refutation)
-        # For now, assume no refutation events exist.
-        # Future: check for 'refute' events for this artifact_hash
-        if "ledger" in required_validators:
-            # For the purpose of this test, if 'ledger' is required and no refutation logic is implemented,
-            # we consider it as not met, causing the universal rule to fail.
-            # A proper implementation would check for actual ledger validation/refutation events.
+        if "signature" in required_validators and h not in signature_index:
             return False
 
     return True
 
 
-def check_threshold_rule(artifact_hashes: list[str], rule: dict, db_path: Path) -> bool:
+def check_threshold_rule(
+    artifact_hashes: list[str], rule: dict, signature_index: SignatureIndex
+) -> bool:
     """
     Enforces the Threshold rule: requires k out of n attestations from specified attestors.
     """
@@ -122,49 +215,47 @@ def check_threshold_rule(artifact_hashes: list[str], rule: dict, db_path: Path)
         # Rule is malformed or incomplete, treat as failure
         return False
 
-    public_key = get_public_key()  # Assuming a single public key for verification for now
-    events = get_all_events(db_path)
-
-    artifact_attestations_count: defaultdict[str, defaultdict[str, int]] = defaultdict(
-        lambda: defaultdict(int)
-    )  # artifact_hash -> attestor_id -> count
-
-    for event in events:
-        if event.get("action") == "sign":
-            artifact_hash = event.get("artifact_hash")
-            attestor_id = event.get("by")  # 'by' field stores the public key fingerprint
-            artifact_signature_hex = event.get("artifact_signature")
-
-            if (
-                artifact_hash
-                and attestor_id
-                and isinstance(attestor_id, str)
-                and attestor_id in attestors
-                and artifact_signature_hex
-            ):
-                artifact_signature = bytes.fromhex(artifact_signature_hex)
-                is_valid = verify_signature(
-                    artifact_signature, artifact_hash.encode("utf-8"), public_key
-                )
-                if is_valid:
-                    artifact_attestations_count[artifact_hash][attestor_id] += 1
+    # Normalized once per rule rather than per artifact
+    attestors_set = frozenset(str(a) for a in attestors if a is not None)
 
     for h in artifact_hashes:
-        valid_attestations_for_artifact = 0
-        for attestor_id_raw in attestors:
-            if attestor_id_raw is None:
-                continue
-            attestor_id_str: str = str(attestor_id_raw)
-            if (
-                artifact_attestations_count[h][attestor_id_str] > 0
-            ):  # Count each attestor once per artifact
-                valid_attestations_for_artifact += 1
-
+        # The index only records attestors with a valid signature, so each distinct
+        # attestor counts once per artifact
+        valid_attestations_for_artifact = len(attestors_set & signature_index.get(h, {}).keys())
         if valid_attestations_for_artifact < k:
             return False
     return True
 
 
+def _requires_signature(policy_config: dict) -> bool:
+    """Returns True if any rule in the policy needs at least one signature per artifact."""
+    return (
+        any(
+            rule.get("min_witnesses", 1) >= 1 for rule in policy_config.get("existential_rules", [])
+        )
+        or any(
+            "signature" in rule.get("required_validators", [])
+            for rule in policy_config.get("universal_rules", [])
+        )
+        or any((rule.get("k") or 0) >= 1 for rule in policy_config.get("threshold_rules", []))
+    )
+
+
+def _requires_ledger_validation(policy_config: dict) -> bool:
+    """Returns True if any universal rule requires the (not yet implemented) ledger validator."""
+    return any(
+        "ledger" in rule.get("required_validators", [])
+        for rule in policy_config.get("universal_rules", [])
+    )
+
+
+def _witnesses_needed(policy_config: dict) -> int:
+    """Returns the most valid signatures per artifact that any rule in the policy asks for."""
+    return max(
+        [1, *(rule.get("min_witnesses", 1) for rule in policy_config.get("existential_rules", []))]
+    )
+
+
 def can_export(artifact_hashes: list[str], db_path: Path) -> bool:
     """
     Determines if export is permitted based on the loaded policy configuration.
@@ -172,19 +263,39 @@ def can_export(artifact_hashes: list[str], db_path: Path) -> bool:
     """
     policy_config = load_policy_config()
 
+    # The sign command records an artifact's assertion together with its ledger event, so
+    # an artifact without one has no signatures. Rules that need a signature then fail for
+    # it, and a single query settles that before any signature is verified.
+    if _requires_signature(policy_config) and count_unsigned_artifacts(artifact_hashes, db_path):
+        return False
+
+    # check_universal_rule fails any rule that requires ledger validation, so settle that
+    # before verifying signatures too.
+    if artifact_hashes and _requires_ledger_validation(policy_config):
+        return False
+
+    # Verify the signatures on the exported artifacts once; every rule is then evaluated
+    # against the tallies
+    # Assuming a single key for verification for now
+    signature_index = _build_signature_index(
+        get_sign_events(artifact_hashes, db_path),
+        get_public_key_fingerprint(),
+        _witnesses_needed(policy_config),
+    )
+
     # Check Existential Rules
     for rule in policy_config.get("existential_rules", []):
-        if not check_existential_rule(artifact_hashes, rule, db_path):
+        if not check_existential_rule(artifact_hashes, rule, signature_index):
             return False
 
     # Check Universal Rules
     for rule in policy_config.get("universal_rules", []):
-        if not check_universal_rule(artifact_hashes, rule, db_path):
+        if not check_universal_rule(artifact_hashes, rule, signature_index):
             return False
 
     # Check Threshold Rules
     for rule in policy_config.get("threshold_rules", []):
-        if not check_threshold_rule(artifact_hashes, rule, db_path):
+        if not check_threshold_rule(artifact_hashes, rule, signature_index):
             return False
 
     return True
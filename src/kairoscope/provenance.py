@@ -6,21 +6,47 @@ Hanldes cryptographic operations for KAIROSCOPE.
 - Creation of C2PA-like assertions.
 """
 
-import json
+import hashlib
+import mmap
+import os
+import stat
+from collections.abc import Callable
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+from typing import BinaryIO
 
-from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.asymmetric.types import PrivateKeyTypes, PublicKeyTypes
 
+from kairoscope import serialization
 from kairoscope.key_manager import FileKeyBackend, KeyManager
 
 # Initialize the default key manager (FileKeyBackend for now)
 _key_manager: KeyManager | None = None
 
 
+# The active manager's default key ID, its public key and fingerprint, and a verifier bound
+# to it, kept until the manager changes.
+_default_key_id: str | None = None
+_public_key_cache: tuple[PublicKeyTypes, str] | None = None
+_verifier: Callable[[bytes, bytes], bool] | None = None
+
+
 def set_key_manager(manager: KeyManager) -> None:
     """Sets the active KeyManager instance."""
     global _key_manager
     _key_manager = manager
+    invalidate_key_cache()
+
+
+def invalidate_key_cache() -> None:
+    """
+    Drops the cached default key ID, public key, fingerprint and verifier, so they are
+    fetched from the active KeyManager again. Call after generating or deleting keys.
+    """
+    global _default_key_id, _public_key_cache, _verifier
+    _default_key_id = None
+    _public_key_cache = None
+    _verifier = None
 
 
 def get_active_key_manager() -> KeyManager:
@@ -30,6 +56,103 @@ def get_active_key_manager() -> KeyManager:
     return _key_manager
 
 
+def _get_default_key_id() -> str:
+    """
+    Returns the ID of the active KeyManager's default key, ensuring it exists.
+    The backend is only asked once per manager.
+    """
+    global _default_key_id
+    if _default_key_id is None:
+        _default_key_id, _ = get_active_key_manager().generate_key_pair()
+    return _default_key_id
+
+
+# Chunk size used when streaming file content through SHA-256.
+HASH_CHUNK_SIZE = 1 << 20
+
+
+def _grow_pipe_buffer(src: BinaryIO) -> None:
+    """
+    Raises the kernel buffer of a piped src to HASH_CHUNK_SIZE so each read can return a full chunk.
+    Does nothing for non-pipes, in-memory streams, or platforms without F_SETPIPE_SZ.
+    """
+    try:
+        import fcntl
+
+        fd = src.fileno()
+        if stat.S_ISFIFO(os.fstat(fd).st_mode):
+            fcntl.fcntl(fd, fcntl.F_SETPIPE_SZ, HASH_CHUNK_SIZE)
+    except (ImportError, AttributeError, OSError, ValueError):
+        pass
+
+
+def copy_and_hash(src: BinaryIO, dest: BinaryIO) -> str:
+    """
+    Copies src to dest in fixed-size chunks, hashing the bytes as they pass through.
+    Chunks are read into a single preallocated buffer, so memory stays flat regardless of input size.
+    Returns the SHA-256 hex digest of the copied content.
+    """
+    _grow_pipe_buffer(src)
+    hasher = hashlib.sha256()
+    buf = bytearray(HASH_CHUNK_SIZE)
+    view = memoryview(buf)
+    while n := src.readinto(buf):  # type: ignore[attr-defined]  # BinaryIO stubs omit readinto
+        chunk = view[:n]
+        hasher.update(chunk)
+        dest.write(chunk)
+    return hasher.hexdigest()
+
+
+def sha256_file(path: Path) -> str:
+    """
+    Returns the SHA-256 hex digest of a file without loading it into memory.
+    The file is memory-mapped so OpenSSL hashes straight from the page cache, using the
+    CPU's SHA extensions where available. Empty files cannot be mapped and fall back to
+    hashlib.file_digest.
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return hashlib.file_digest(f, "sha256").hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            if hasattr(mapped, "madvise"):
+                mapped.madvise(mmap.MADV_SEQUENTIAL)
+            return hashlib.sha256(mapped).hexdigest()
+
+
+# Batches at least this large are hashed in worker processes; below it, process start-up
+# costs more than it saves.
+PROCESS_POOL_MIN_FILES = 64
+
+
+def sha256_many(paths: list[Path]) -> list[str]:
+    """
+    Returns the SHA-256 hex digests of several files, in the order given.
+    hashlib releases the GIL while OpenSSL hashes, so small batches are hashed on a thread
+    pool. Large batches are mostly small files, whose per-file Python work holds the GIL,
+    so they are spread over worker processes instead. The largest files are started first
+    so no worker is left with a long tail.
+    """
+    if len(paths) <= 1:
+        return [sha256_file(path) for path in paths]
+    order = sorted(range(len(paths)), key=lambda i: paths[i].stat().st_size, reverse=True)
+
+    executor: Executor
+    if len(paths) >= PROCESS_POOL_MIN_FILES:
+        workers = os.cpu_count() or 1
+        executor = ProcessPoolExecutor(max_workers=workers)
+        chunksize = max(1, len(paths) // (4 * workers))  # Amortize pickling per task
+    else:
+        executor = ThreadPoolExecutor()
+        chunksize = 1
+
+    digests = [""] * len(paths)
+    with executor:
+        results = executor.map(sha256_file, [paths[i] for i in order], chunksize=chunksize)
+        for i, digest in zip(order, results, strict=True):
+            digests[i] = digest
+    return digests
+
+
 # For simplicity in v0.1; use env var or KMS in production.
 # This is now handled within FileKeyBackend but kept for consistency if needed elsewhere.
 KEY_PASSWORD = None
@@ -43,9 +166,9 @@ def get_keypair() -> PrivateKeyTypes:
     scenario, this would typically return a key_id.
     """
     manager = get_active_key_manager()
-    # For FileKeyBackend, generate_key_pair ensures the key exists and returns its ID.
+    # For FileKeyBackend, _get_default_key_id ensures the key exists and returns its ID.
     # We then retrieve the actual private key object for compatibility.
-    key_id, _ = manager.generate_key_pair()
+    _get_default_key_id()
     # This is a temporary workaround to get the actual private key object
     # from FileKeyBackend, as other backends won't expose it.
     # Future refactoring will pass key_id instead of private_key objects.
@@ -58,19 +181,31 @@ def get_keypair() -> PrivateKeyTypes:
 
 def get_public_key(private_key: PrivateKeyTypes | None = None) -> PublicKeyTypes:
     """Returns the public key from a private key or loads it from the active KeyManager."""
-    manager = get_active_key_manager()
     if private_key:
         return private_key.public_key()
     # If no private_key is provided, assume we need the public key of the default key.
-    key_id, _ = manager.generate_key_pair()  # Ensure default key exists
-    return manager.get_public_key(key_id)
+    return _get_default_public_key()[0]
 
 
 def get_public_key_fingerprint() -> str:
     """Returns the SHA256 fingerprint of the public key from the active KeyManager."""
-    manager = get_active_key_manager()
-    key_id, _ = manager.generate_key_pair()  # Ensure default key exists
-    return manager.get_public_key_fingerprint(key_id)
+    return _get_default_public_key()[1]
+
+
+def _get_default_public_key() -> tuple[PublicKeyTypes, str]:
+    """
+    Returns the default key's public key and fingerprint, loading them from the active
+    KeyManager only on first use after set_key_manager.
+    """
+    global _public_key_cache
+    if _public_key_cache is None:
+        manager = get_active_key_manager()
+        key_id = _get_default_key_id()
+        _public_key_cache = (
+            manager.get_public_key(key_id),
+            manager.get_public_key_fingerprint(key_id),
+        )
+    return _public_key_cache
 
 
 def sign_bytes(data: bytes) -> bytes:
@@ -78,14 +213,17 @@ def sign_bytes(data: bytes) -> bytes:
     Signs a byte string using the active KeyManager.
     The data is first hashed before being passed to the KeyManager's sign_digest method.
     """
-    manager = get_active_key_manager()
-    key_id, _ = manager.generate_key_pair()  # Ensure default key exists
-
     # Hash the data before signing the digest
-    hasher = hashes.Hash(hashes.SHA256())
-    hasher.update(data)
-    digest = hasher.finalize()
+    return sign_digest(hashlib.sha256(data).digest())
 
+
+def sign_digest(digest: bytes) -> bytes:
+    """
+    Signs an already computed SHA-256 digest with the active KeyManager's default key,
+    for callers that have the digest at hand.
+    """
+    manager = get_active_key_manager()
+    key_id = _get_default_key_id()
     return manager.sign_digest(key_id, digest)
 
 
@@ -93,15 +231,28 @@ def verify_signature(
     signature: bytes, data: bytes, public_key: PublicKeyTypes | None = None
 ) -> bool:
     """Verifies a signature against the data using the public key associated with key_id."""
-    manager = get_active_key_manager()
-    key_id, _ = manager.generate_key_pair()  # Ensure default key exists
-
     # Hash the data to create a digest for verification
-    hasher = hashes.Hash(hashes.SHA256())
-    hasher.update(data)
-    digest = hasher.finalize()
+    return verify_digest(signature, hashlib.sha256(data).digest())
+
 
-    return manager.verify_signature(key_id, signature, digest)
+def verify_digest(signature: bytes, digest: bytes) -> bool:
+    """
+    Verifies a signature against an already computed SHA-256 digest of the signed data,
+    for callers that verify several signatures over the same data.
+    """
+    return get_default_verifier()(signature, digest)
+
+
+def get_default_verifier() -> Callable[[bytes, bytes], bool]:
+    """
+    Returns the active KeyManager's verifier for the default key, resolving it only on first
+    use after set_key_manager. Call from the thread that owns the database connection before
+    verifying on other threads, as backends may read their key index while resolving it.
+    """
+    global _verifier
+    if _verifier is None:
+        _verifier = get_active_key_manager().get_verifier(_get_default_key_id())
+    return _verifier
 
 
 def create_assertion(artifact_hash: str, signature_hex: str) -> str:
@@ -110,7 +261,7 @@ def create_assertion(artifact_hash: str, signature_hex: str) -> str:
     This now includes key_id and key_backend_type from the active KeyManager.
     """
     manager = get_active_key_manager()
-    key_id, _ = manager.generate_key_pair()  # Ensure default key exists
+    key_id = _get_default_key_id()
     assertion = {
         "alg": manager.get_algorithm(key_id),
         "hash": artifact_hash,
@@ -120,4 +271,4 @@ def create_assertion(artifact_hash: str, signature_hex: str) -> str:
         "key_backend_type": manager.__class__.__name__.replace("KeyBackend", "").lower(),
     }
     # Using compact, sorted JSON for deterministic output.
-    return json.dumps(assertion, sort_keys=True, separators=(",", ":"))
+    return serialization.dumps(assertion, sort_keys=True)
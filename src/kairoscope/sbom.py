@@ -1,2 +1,78 @@
-# This file is now largely a placeholder as SBOM generation is handled by cyclonedx-bom directly in cli.py
-# Future: This file could contain logic for parsing/validating SBOMs or integrating with cyclonedx-python-lib
+import contextlib
+import io
+import logging
+import os
+import stat
+import subprocess
+import sys
+from pathlib import Path
+
+
+def _environment_args(output_path: Path) -> list[str]:
+    # Scan the current Python interpreter's environment and write the BOM to output_path
+    return ["environment", "-o", str(output_path), sys.executable]
+
+
+# Generated SBOMs by environment state, so repeat exports in one process reuse the scan
+_sbom_cache: dict[tuple, bytes] = {}
+
+
+def _environment_key() -> tuple:
+    """
+    Identifies the installed package set. Installing, upgrading or removing a distribution
+    adds or renames its .dist-info directory, which changes its parent directory's mtime.
+    """
+    directories = []
+    for p in sys.path:
+        # Entries that are missing or unreadable can't hold packages, so they are skipped
+        with contextlib.suppress(OSError):
+            path_stat = os.stat(p)
+            if stat.S_ISDIR(path_stat.st_mode):
+                directories.append((p, path_stat.st_mtime_ns))
+    return (sys.prefix, tuple(directories))
+
+
+def generate_sbom(output_path: Path) -> None:
+    """
+    Generates a CycloneDX SBOM of the current Python environment.
+    The SBOM is cached for the life of the process until the installed packages change.
+    Raises RuntimeError with the tool's error output if generation fails.
+    """
+    environment_key = _environment_key()
+    cached = _sbom_cache.get(environment_key)
+    if cached is not None:
+        output_path.write_bytes(cached)
+        return
+    _run_cyclonedx(output_path)
+    _sbom_cache[environment_key] = output_path.read_bytes()
+
+
+def _run_cyclonedx(output_path: Path) -> None:
+    """Runs cyclonedx-py in-process when it is importable, falling back to a subprocess otherwise."""
+    try:
+        # cyclonedx-py exposes no public library API; this is the entry point behind `python -m cyclonedx_py`
+        from cyclonedx_py._internal.cli import run
+    except ImportError:
+        command = [sys.executable, "-m", "cyclonedx_py", *_environment_args(output_path)]
+        try:
+            subprocess.run(command, check=True, capture_output=True, text=True)
+        except subprocess.CalledProcessError as e:
+            raise RuntimeError(e.stderr) from e
+        return
+
+    stderr = io.StringIO()
+    exit_code: int | str | None
+    logger = logging.getLogger("CDX")
+    handlers_before = list(logger.handlers)
+    try:
+        with contextlib.redirect_stderr(stderr):
+            exit_code = run(argv=_environment_args(output_path))
+    except SystemExit as e:  # Raised by argparse on invalid arguments
+        exit_code = e.code
+    finally:
+        # run() attaches a fresh stderr handler on every call; remove the ones it added so
+        # repeated exports don't accumulate them, keeping any configured by the application
+        for handler in [h for h in logger.handlers if h not in handlers_before]:
+            logger.removeHandler(handler)
+    if exit_code != 0:
+        raise RuntimeError(stderr.getvalue())
@@ -0,0 +1,31 @@
+"""
+JSON encoding and decoding for KAIROSCOPE.
+
+Uses orjson when it is installed and falls back to the standard library otherwise.
+Both back ends produce compact JSON that decodes to the same Python objects.
+"""
+
+import json
+from typing import Any
+
+try:
+    import orjson
+except ImportError:  # orjson is an optional speedup
+    orjson = None  # type: ignore[assignment]
+
+
+def dumps(obj: Any, sort_keys: bool = False, indent: bool = False) -> str:
+    """Serializes obj to compact JSON text, or indented by two spaces for display."""
+    if orjson is not None:
+        option = (orjson.OPT_SORT_KEYS if sort_keys else 0) | (orjson.OPT_INDENT_2 if indent else 0)
+        return orjson.dumps(obj, option=option).decode("utf-8")
+    if indent:
+        return json.dumps(obj, sort_keys=sort_keys, indent=2)
+    return json.dumps(obj, sort_keys=sort_keys, separators=(",", ":"))
+
+
+def loads(data: str | bytes) -> Any:
+    """Deserializes JSON text or bytes."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
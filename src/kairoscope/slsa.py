@@ -1,13 +1,19 @@
-import hashlib
-import json
 from pathlib import Path
 
+from kairoscope import serialization
+from kairoscope.provenance import sha256_file
 
-def generate_slsa_attestation(artifact_path: Path, output_path: Path, predicate: dict) -> None:
+
+def generate_slsa_attestation(
+    artifact_path: Path, output_path: Path, predicate: dict, artifact_hash: str | None = None
+) -> None:
     """
     Generates a SLSA attestation for the given artifact path.
+    artifact_hash is the artifact's SHA256 hex digest when the caller already has it;
+    otherwise the file is hashed.
     """
-    artifact_hash = hashlib.sha256(artifact_path.read_bytes()).hexdigest()
+    if artifact_hash is None:
+        artifact_hash = sha256_file(artifact_path)
 
     attestation_content = {
         "_type": "https://in-toto.io/Statement/v0.1",
@@ -16,5 +22,5 @@ def generate_slsa_attestation(artifact_path: Path, output_path: Path, predicate:
         "predicate": predicate,
     }
     output_path.parent.mkdir(parents=True, exist_ok=True)
-    with open(output_path, "w") as f:
-        json.dump(attestation_content, f, indent=2)
+    # Compact, sorted JSON so the attestation's bytes are deterministic
+    output_path.write_text(serialization.dumps(attestation_content, sort_keys=True) + "\n")
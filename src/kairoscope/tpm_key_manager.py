@@ -1,19 +1,116 @@
+import atexit
+import contextlib
+import functools
+import threading
+from collections.abc import Callable
+from pathlib import Path
+from typing import Any
+
+from cryptography.exceptions import InvalidSignature
 from cryptography.hazmat.primitives import hashes, serialization
-from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives.asymmetric import ec, utils
 from cryptography.hazmat.primitives.asymmetric.types import PublicKeyTypes
 from tpm2_pytss.constants import (
+    ESYS_TR,
     TPM2_ALG,
+    TPM2_CAP,
+    TPM2_HC,
     TPM2_HT,
     TPM2_RC,
     TPM2_RH,
+    TPM2_SE,
     TPM2_ST,
 )
 
 # Import tpm2_pytss components
 from tpm2_pytss.ESAPI import ESAPI
 from tpm2_pytss.exceptions import TPM2_Exception
+from tpm2_pytss.types import TPMT_SYM_DEF
+
+from kairoscope.db import delete_tpm_key, get_all_tpm_keys, get_db_path, get_tpm_key, insert_tpm_key
+from kairoscope.key_manager import KeyManager, _sha256
+
+# Label given to the key that generate_key_pair creates when no label is requested
+DEFAULT_TPM_KEY_LABEL = "default-tpm-key"
+
+# Versions before the tpm_keys index persisted their single key at this fixed handle
+LEGACY_PERSISTENT_HANDLE = TPM2_HT.PERSISTENT | 0x00000001
+
+# Versions before DER encoding stored TPM signatures as raw r || s, 48 bytes each for P-384
+LEGACY_RAW_SIGNATURE_SIZE = 96
+
+# Persistent handles asked for per TPM2_GetCapability call
+_CAPABILITY_HANDLE_COUNT = 64
+
+# ESAPI connections are opened once per TCTI and shared by every backend in the process,
+# so creating another TpmKeyBackend doesn't renegotiate with the resource manager.
+_esapi_pool: dict[str, ESAPI] = {}
+# HMAC authorization session per pooled connection, started on the first signature and
+# reused for every later one
+_esapi_sessions: dict[str, Any] = {}
+_esapi_pool_lock = threading.Lock()
+
+
+def _get_pooled_esapi(tcti_name: str) -> ESAPI:
+    with _esapi_pool_lock:
+        esapi = _esapi_pool.get(tcti_name)
+        if esapi is None:
+            esapi = _esapi_pool[tcti_name] = ESAPI(tcti_name)
+        return esapi
+
+
+def _get_pooled_session(tcti_name: str) -> Any:
+    """Returns the HMAC session on the pooled connection for tcti_name, starting it on first use."""
+    esapi = _get_pooled_esapi(tcti_name)
+    with _esapi_pool_lock:
+        session = _esapi_sessions.get(tcti_name)
+        if session is None:
+            session = _esapi_sessions[tcti_name] = esapi.start_auth_session(
+                tpm_key=ESYS_TR.NONE,
+                bind=ESYS_TR.NONE,
+                session_type=TPM2_SE.HMAC,
+                symmetric=TPMT_SYM_DEF(algorithm=TPM2_ALG.NULL),
+                auth_hash=TPM2_ALG.SHA256,
+            )
+        return session
+
+
+def close_esapi_connections() -> None:
+    """Flushes the pooled sessions and closes all pooled TPM connections."""
+    with _esapi_pool_lock:
+        while _esapi_sessions:
+            tcti_name, session = _esapi_sessions.popitem()
+            esapi = _esapi_pool.get(tcti_name)
+            if esapi is not None:
+                # A failed flush mustn't keep the remaining connections open
+                with contextlib.suppress(TPM2_Exception):
+                    esapi.flush_context(session)
+        while _esapi_pool:
+            _, esapi = _esapi_pool.popitem()
+            esapi.close()
+
 
-from kairoscope.key_manager import KeyManager
+atexit.register(close_esapi_connections)
+
+
+@functools.lru_cache(maxsize=64)
+def _fingerprint_from_pem(public_key_pem: bytes) -> str:
+    """
+    Calculates the SHA256 fingerprint of a public key PEM.
+    The TPM hands back the same PEM for a key on every read, so the parse and DER
+    re-encoding are done once per key.
+    """
+    public_key = serialization.load_pem_public_key(public_key_pem)
+    der_bytes = public_key.public_bytes(
+        encoding=serialization.Encoding.DER,
+        format=serialization.PublicFormat.SubjectPublicKeyInfo,
+    )
+    return _fingerprint_from_der(der_bytes)
+
+
+def _fingerprint_from_der(public_key_der: bytes) -> str:
+    """Calculates the SHA256 fingerprint of a SubjectPublicKeyInfo DER public key."""
+    return f"sha256:{_sha256(public_key_der)}"
 
 
 class TpmKeyBackend(KeyManager):
@@ -21,16 +118,21 @@ class TpmKeyBackend(KeyManager):
     KeyManager implementation for TPM-backed key storage using tpm2-pytss.
     """
 
-    def __init__(self, tcti_name: str = "tabrmd"):
+    def __init__(self, tcti_name: str = "tabrmd", db_path: Path | None = None):
         self.tcti_name = tcti_name
+        # Generated keys are indexed in the tpm_keys table, mapping key_id to persistent handle
+        self.db_path = db_path if db_path is not None else get_db_path()
         self._esapi: ESAPI | None = None
+        # persistent handle -> (outPublic, public key PEM, fingerprint)
+        self._pub_cache: dict[int, tuple[Any, bytes, str]] = {}
+        self._ecdsa_prehashed_sha256 = ec.ECDSA(utils.Prehashed(hashes.SHA256()))
         self._connect_esapi()
 
     def _connect_esapi(self):
         """Establishes a connection to the TPM."""
         if self._esapi is None:
             try:
-                self._esapi = ESAPI(self.tcti_name)
+                self._esapi = _get_pooled_esapi(self.tcti_name)
             except TPM2_Exception as e:
                 raise RuntimeError(
                     f"Failed to connect to TPM using TCTI '{self.tcti_name}': {e}"
@@ -44,18 +146,90 @@ class TpmKeyBackend(KeyManager):
             raise RuntimeError("TPM connection not established.")
         return self._esapi
 
+    def _get_key_record(self, key_id: str) -> dict[str, Any]:
+        """Returns the tpm_keys row for key_id, raising ValueError if this backend doesn't hold it."""
+        record = get_tpm_key(key_id, self.db_path)
+        if record is None:
+            raise ValueError(f"Key with ID {key_id} not managed by this TpmKeyBackend instance.")
+        return record
+
+    def _read_public_cached(self, persistent_handle: int) -> tuple[Any, bytes, str]:
+        """
+        Returns (outPublic, public key PEM, fingerprint) for a persistent handle.
+        The TPM is only asked on the first call per handle; generate_key_pair and delete_key
+        drop the entry when the handle is replaced or evicted.
+        """
+        cached = self._pub_cache.get(persistent_handle)
+        if cached is None:
+            out_public = self._get_esapi().readpublic(objectHandle=persistent_handle).outPublic
+            public_key_pem = out_public.to_pem()
+            if hasattr(out_public, "to_der"):
+                # The TPM's public area encodes straight to DER, skipping the PEM parse/re-encode
+                fingerprint = _fingerprint_from_der(bytes(out_public.to_der()))
+            else:
+                fingerprint = self._calculate_fingerprint_from_public_key(public_key_pem)
+            cached = (out_public, public_key_pem, fingerprint)
+            self._pub_cache[persistent_handle] = cached
+        return cached
+
     def _calculate_fingerprint_from_public_key(self, public_key_pem: bytes) -> str:
         """Helper to calculate SHA256 fingerprint from a public key PEM."""
-        public_key = serialization.load_pem_public_key(public_key_pem)
-        der_bytes = public_key.public_bytes(
-            encoding=serialization.Encoding.DER,
-            format=serialization.PublicFormat.SubjectPublicKeyInfo,
+        return _fingerprint_from_pem(bytes(public_key_pem))
+
+    def _get_indexed_keys(self) -> list[dict[str, Any]]:
+        """
+        Returns the tpm_keys index. While the index is empty, a key persisted at
+        LEGACY_PERSISTENT_HANDLE by an earlier version is adopted into it as the default key.
+        """
+        keys = get_all_tpm_keys(self.db_path)
+        if keys:
+            return keys
+        try:
+            _, public_key_pem, key_id = self._read_public_cached(LEGACY_PERSISTENT_HANDLE)
+        except TPM2_Exception as e:
+            if e.rc == TPM2_RC.HANDLE:  # No legacy key
+                return keys
+            raise RuntimeError(f"Failed to read legacy TPM key: {e}") from e
+        insert_tpm_key(
+            key_id,
+            LEGACY_PERSISTENT_HANDLE,
+            DEFAULT_TPM_KEY_LABEL,
+            "ES384",
+            public_key_pem,
+            self.db_path,
         )
-        digest = hashes.Hash(hashes.SHA256())
-        digest.update(der_bytes)
-        return f"sha256:{digest.finalize().hex()}"
+        return get_all_tpm_keys(self.db_path)
+
+    def _get_used_persistent_handles(self) -> set[int]:
+        """Returns every persistent handle in use on the TPM, including ones not in the index."""
+        esapi = self._get_esapi()
+        handles: set[int] = set()
+        next_handle = TPM2_HC.PERSISTENT_FIRST
+        more_data = True
+        while more_data:
+            more_data, capability_data = esapi.get_capability(
+                TPM2_CAP.HANDLES, next_handle, _CAPABILITY_HANDLE_COUNT
+            )
+            batch = [int(handle) for handle in capability_data.data.handles]
+            if not batch:
+                break
+            handles.update(batch)
+            next_handle = max(batch) + 1
+        return handles
+
+    def generate_key_pair(
+        self, curve: str | None = None, label: str | None = None
+    ) -> tuple[str, str]:
+        # Like FileKeyBackend, this ensures a key exists: a label that is already indexed
+        # returns its key rather than creating another.
+        if curve not in (None, "P384"):
+            raise ValueError(f"Unsupported curve for TPM keys: {curve}")
+        label = label or DEFAULT_TPM_KEY_LABEL
+        keys = self._get_indexed_keys()
+        for record in keys:
+            if record["label"] == label:
+                return record["key_id"], record["pem"].decode("utf-8")
 
-    def generate_key_pair(self, curve: str = "P384", label: str | None = None) -> tuple[str, str]:
         esapi = self._get_esapi()
 
         # Define key parameters for ECC P384
@@ -97,84 +271,57 @@ class TpmKeyBackend(KeyManager):
                 inPublic=create_result.outPublic,
             )
 
-            # Make the key persistent
-            persistent_handle = esapi.evictcontrol(
-                auth=TPM2_RH.OWNER,
-                objectHandle=private_handle.handle,
-                persistentHandle=TPM2_HT.PERSISTENT
-                | 0x00000001,  # Use a fixed persistent handle for now
-            ).persistentHandle
+            # Make the key persistent at the first free handle. A handle taken by another
+            # TPM user since the probe fails with NV_DEFINED, and the next one is tried.
+            used_handles = self._get_used_persistent_handles()
+            candidate = TPM2_HC.PERSISTENT_FIRST
+            while True:
+                while candidate in used_handles:
+                    candidate += 1
+                try:
+                    persistent_handle = esapi.evictcontrol(
+                        auth=TPM2_RH.OWNER,
+                        objectHandle=private_handle.handle,
+                        persistentHandle=candidate,
+                    ).persistentHandle
+                    break
+                except TPM2_Exception as e:
+                    if e.rc != TPM2_RC.NV_DEFINED:
+                        raise
+                    used_handles.add(candidate)
+            self._pub_cache.pop(persistent_handle, None)
 
             # Read the public part of the key
-            read_pub_result = esapi.readpublic(objectHandle=persistent_handle)
-            public_key_pem = read_pub_result.outPublic.to_pem()
-            key_id = self._calculate_fingerprint_from_public_key(public_key_pem)
-
-            # Store the key_id and persistent handle mapping (e.g., in a simple dict or config file)
-            # For now, we'll just return the key_id and PEM.
-            # In a real scenario, you'd manage persistent handles and their associated key_ids.
-
-            return key_id, public_key_pem.decode("utf-8")
-
+            _, public_key_pem, key_id = self._read_public_cached(persistent_handle)
         except TPM2_Exception as e:
             raise RuntimeError(f"Failed to generate TPM key pair: {e}") from e
 
-    def get_public_key(self, key_id: str) -> PublicKeyTypes:
-        esapi = self._get_esapi()
-        # This is a simplified approach. In a real system, you'd map key_id to persistent handle.
-        # For now, we assume the key_id corresponds to a known persistent handle.
-        # We'll use the fixed handle used in generate_key_pair for demonstration.
-        persistent_handle = TPM2_HT.PERSISTENT | 0x00000001
+        insert_tpm_key(key_id, persistent_handle, label, "ES384", public_key_pem, self.db_path)
+        return key_id, public_key_pem.decode("utf-8")
 
-        try:
-            read_pub_result = esapi.readpublic(objectHandle=persistent_handle)
-            public_key_pem = read_pub_result.outPublic.to_pem()
-
-            # Verify that the key_id matches the fingerprint of the retrieved public key
-            if self._calculate_fingerprint_from_public_key(public_key_pem) != key_id:
-                raise ValueError(f"Key ID mismatch for persistent handle {persistent_handle}")
-
-            return serialization.load_pem_public_key(public_key_pem)
-        except TPM2_Exception as e:
-            raise RuntimeError(f"Failed to retrieve public key from TPM: {e}") from e
+    def get_public_key(self, key_id: str) -> PublicKeyTypes:
+        # The public key was indexed when the key was generated, so no TPM command is needed
+        return serialization.load_pem_public_key(self._get_key_record(key_id)["pem"])
 
     def get_public_key_pem(self, key_id: str) -> str:
-        esapi = self._get_esapi()
-        persistent_handle = TPM2_HT.PERSISTENT | 0x00000001
-
-        try:
-            read_pub_result = esapi.readpublic(objectHandle=persistent_handle)
-            public_key_pem = read_pub_result.outPublic.to_pem()
-
-            if self._calculate_fingerprint_from_public_key(public_key_pem) != key_id:
-                raise ValueError(f"Key ID mismatch for persistent handle {persistent_handle}")
-
-            return public_key_pem.decode("utf-8")
-        except TPM2_Exception as e:
-            raise RuntimeError(f"Failed to retrieve public key PEM from TPM: {e}") from e
+        return self._get_key_record(key_id)["pem"].decode("utf-8")
 
     def get_public_key_fingerprint(self, key_id: str) -> str:
         # For TPM keys, the key_id is the fingerprint
-        # We should verify that the key exists and its fingerprint matches
-        self.get_public_key(key_id)  # This will raise an error if key_id is not found or mismatched
+        # We should verify that the key exists
+        self._get_key_record(key_id)  # This will raise an error if key_id is not found
         return key_id
 
     def sign_digest(self, key_id: str, digest: bytes) -> bytes:
         esapi = self._get_esapi()
-        persistent_handle = TPM2_HT.PERSISTENT | 0x00000001
+        persistent_handle = self._get_key_record(key_id)["persistent_handle"]
 
-        # Load the persistent key into the transient area for signing
+        # A persistent key is signed with directly by its handle; it needs no load or flush.
+        # Reusing one HMAC session leaves a single TPM command per signature.
         try:
-            load_result = esapi.load(
-                parentHandle=TPM2_RH.OWNER,
-                inPrivate=esapi.TPM2B_PRIVATE(),  # Not needed for persistent key
-                inPublic=esapi.readpublic(objectHandle=persistent_handle).outPublic,
-            )
-            key_handle = load_result.handle
-
-            # Sign the digest
+            session = _get_pooled_session(self.tcti_name)
             sign_result = esapi.sign(
-                keyHandle=key_handle,
+                keyHandle=persistent_handle,
                 digest=esapi.TPM2B_DIGEST(digest),
                 inScheme=esapi.TPMT_SIG_SCHEME(
                     scheme=TPM2_ALG.ECDSA, details=esapi.TPMU_SIG_SCHEME(hashAlg=TPM2_ALG.SHA256)
@@ -182,133 +329,78 @@ class TpmKeyBackend(KeyManager):
                 validation=esapi.TPMT_TK_HASHCHECK(
                     tag=TPM2_ST.HASHCHECK, hierarchy=TPM2_RH.NULL, digest=b""
                 ),
+                session1=session,
             )
 
-            # Unload the key from transient area
-            esapi.flushcontext(flushHandle=key_handle)
-
-            # Convert the signature to a format compatible with cryptography library (ASN.1 DER)
-            # tpm2-pytss returns r and s components. We need to encode them.
+            # Encode the r and s components as an ASN.1 DER ECDSA signature, the form
+            # cryptography and other external verifiers expect
             r = sign_result.signature.signature.signatureR.buffer
             s = sign_result.signature.signature.signatureS.buffer
-
-            # Pad r and s with leading zeros if necessary to match expected length (P384 is 48 bytes)
-            # This is a simplification; proper ASN.1 DER encoding should be used.
-            # For now, assuming fixed length for P384 (48 bytes for r and s)
-            # r_padded = r.rjust(48, b"\x00")
-            # s_padded = s.rjust(48, b"\x00")
-
-            # This is a very basic attempt at DER encoding for ECDSA.
-            # A more robust solution would use a dedicated ASN.1 library or cryptography's internal methods.
-            # For P384, r and s are 48 bytes.
-            # Sequence header: 0x30
-            # Length of sequence: (length of r_int + length of s_int + 4 bytes for type/length of each)
-            # Integer type: 0x02
-            # Length of integer: length of r_int
-            # r_int bytes
-            # Integer type: 0x02
-            # Length of integer: length of s_int
-            # s_int bytes
-
-            # Example for P384 (48 bytes for r and s)
-            # r_len = len(r_padded)
-            # s_len = len(s_padded)
-            # total_len = r_len + s_len + 4 # 2 for type, 2 for length
-            # der_signature = b'\x30' + total_len.to_bytes(1, 'big') + \
-            #                 b'\x02' + r_len.to_bytes(1, 'big') + r_padded + \
-            #                 b'\x02' + s_len.to_bytes(1, 'big') + s_padded
-
-            # For now, return a concatenated r and s, which `cryptography` might not directly accept for verification
-            # This will need proper ASN.1 DER encoding for compatibility with `cryptography`'s verify method.
-            # For testing purposes, we might need to adjust the verify_signature method in FileKeyBackend
-            # or implement a TPM-specific verification.
-
-            # For now, returning raw r and s concatenated. This will likely fail cryptography's verification.
-            # TODO: Implement proper ASN.1 DER encoding for ECDSA signature.
-            return r + s
+            return utils.encode_dss_signature(int.from_bytes(r, "big"), int.from_bytes(s, "big"))
 
         except TPM2_Exception as e:
             raise RuntimeError(f"Failed to sign digest with TPM: {e}") from e
 
     def verify_signature(self, key_id: str, signature: bytes, digest: bytes) -> bool:
-        # For TPM-generated signatures, verification can be done using the public key
-        # and the cryptography library, provided the signature format is compatible (ASN.1 DER).
-        # Since sign_digest currently returns concatenated r+s, this will likely fail.
-        # TODO: Adjust this once sign_digest returns proper DER.
-        public_key = self.get_public_key(key_id)
-
-        # Assuming signature is r + s concatenation for now, need to split and re-encode for cryptography
-        # This is a placeholder and will need to be updated once sign_digest produces DER.
-        # For P384, r and s are 48 bytes each.
-        r = signature[:48]
-        s = signature[48:]
-
-        # Re-encode r and s into ASN.1 DER for cryptography's verify method
-        # This is a simplified encoding and might not be fully compliant for all cases.
-        # A proper ASN.1 DER encoder should be used.
-        try:
-            from cryptography.hazmat.primitives.asymmetric import utils
-            from cryptography.hazmat.primitives.asymmetric.ec import EllipticCurvePublicKey
+        return self.get_verifier(key_id)(signature, digest)
 
-            if isinstance(public_key, EllipticCurvePublicKey):
-                # Convert r and s to integers
-                r_int = int.from_bytes(r, "big")
-                s_int = int.from_bytes(s, "big")
-
-                # Create an ECDSA signature object
-                ecdsa_signature = utils.encode_dss_signature(r_int, s_int)
+    def get_verifier(self, key_id: str) -> Callable[[bytes, bytes], bool]:
+        # TPM-generated signatures are DER encoded, so they are verified in software with the
+        # public key. The TPM signs the digest itself rather than a hash of it.
+        # The key is loaded from the index now, in the caller's thread: the returned verifier
+        # may run on worker threads, which can't use this thread's database connection.
+        public_key = self.get_public_key(key_id)
+        if not isinstance(public_key, ec.EllipticCurvePublicKey):
+            return lambda signature, digest: False
+        verify_ecdsa, algorithm = public_key.verify, self._ecdsa_prehashed_sha256
 
-                public_key.verify(ecdsa_signature, digest, ec.ECDSA(hashes.SHA256()))
+        def verify(signature: bytes, digest: bytes) -> bool:
+            try:
+                verify_ecdsa(signature, digest, algorithm)
                 return True
-            else:
+            except (InvalidSignature, ValueError):
+                # Malformed signatures are invalid rather than errors
+                if len(signature) != LEGACY_RAW_SIGNATURE_SIZE:
+                    return False
+            # Signatures recorded before DER encoding are raw r || s
+            half = LEGACY_RAW_SIGNATURE_SIZE // 2
+            legacy_signature = utils.encode_dss_signature(
+                int.from_bytes(signature[:half], "big"), int.from_bytes(signature[half:], "big")
+            )
+            try:
+                verify_ecdsa(legacy_signature, digest, algorithm)
+            except InvalidSignature:
                 return False
-        except Exception:
-            return False
+            return True
+
+        return verify
 
     def get_algorithm(self, key_id: str) -> str:
-        # Assuming P384 ECC for now
-        self.get_public_key(key_id)  # Ensure key exists
-        return "ES384"
+        return self._get_key_record(key_id)["algorithm"]
 
     def list_keys(self) -> list[dict[str, str]]:
-        esapi = self._get_esapi()
-        keys = []
-        # This is a simplified listing. In a real system, you'd iterate through
-        # persistent handles or a managed list of keys.
-        # For now, we check if our fixed persistent handle exists.
-        persistent_handle = TPM2_HT.PERSISTENT | 0x00000001
-        try:
-            read_pub_result = esapi.readpublic(objectHandle=persistent_handle)
-            public_key_pem = read_pub_result.outPublic.to_pem()
-            key_id = self._calculate_fingerprint_from_public_key(public_key_pem)
-            keys.append(
-                {
-                    "id": key_id,
-                    "label": "default-tpm-key",
-                    "type": "ECC",
-                    "backend": "tpm",
-                    "public_key_pem": public_key_pem.decode("utf-8"),
-                }
-            )
-        except TPM2_Exception as e:
-            if e.rc == TPM2_RC.HANDLE:  # Handle not found
-                pass
-            else:
-                raise RuntimeError(f"Failed to list TPM keys: {e}") from e
-        return keys
+        # Keys are listed from the index; the TPM is only queried for a legacy key to adopt
+        return [
+            {
+                "id": record["key_id"],
+                "label": record["label"],
+                "type": "ECC",
+                "backend": "tpm",
+                "public_key_pem": record["pem"].decode("utf-8"),
+            }
+            for record in self._get_indexed_keys()
+        ]
 
     def delete_key(self, key_id: str) -> None:
         esapi = self._get_esapi()
-        persistent_handle = TPM2_HT.PERSISTENT | 0x00000001
-
-        # Verify key_id before deleting
-        if (
-            self._calculate_fingerprint_from_public_key(self.get_public_key_pem(key_id).encode())
-            != key_id
-        ):
-            raise ValueError(f"Key ID mismatch for persistent handle {persistent_handle}")
+        # Raises ValueError if the key isn't indexed
+        persistent_handle = self._get_key_record(key_id)["persistent_handle"]
 
         try:
+            # Verify the handle still holds key_id before evicting it, with a single readpublic
+            _, _, fingerprint = self._read_public_cached(persistent_handle)
+            if fingerprint != key_id:
+                raise ValueError(f"Key ID mismatch for persistent handle {persistent_handle}")
             esapi.evictcontrol(
                 auth=TPM2_RH.OWNER,
                 objectHandle=persistent_handle,
@@ -319,3 +411,5 @@ class TpmKeyBackend(KeyManager):
                 pass
             else:
                 raise RuntimeError(f"Failed to delete TPM key: {e}") from e
+        self._pub_cache.pop(persistent_handle, None)
+        delete_tpm_key(key_id, self.db_path)
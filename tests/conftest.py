@@ -1,20 +1,46 @@
+import os
+import shutil
+import uuid
 from pathlib import Path
 
 import pytest
 
-from kairoscope.db import initialize_db
+from kairoscope.db import close_db_connections, initialize_db
+
+# Set KAIROSCOPE_TEST_INMEM=1 to run tests against shared-cache in-memory databases
+TEST_INMEM = os.environ.get("KAIROSCOPE_TEST_INMEM") == "1"
+
+
+@pytest.fixture(scope="session")
+def template_db(tmp_path_factory: pytest.TempPathFactory) -> Path:
+    # Run the schema DDL once per session; tests start from a copy of this file
+    template_path = tmp_path_factory.mktemp("template") / "template.db"
+    initialize_db(template_path)
+    # Closing checkpoints the WAL into the main file so a plain file copy is complete
+    close_db_connections()
+    return template_path
 
 
 @pytest.fixture(autouse=True)
-def setup_db_for_tests(tmp_path: Path):
+def setup_db_for_tests(tmp_path: Path, template_db: Path):
+    if TEST_INMEM:
+        # The database lives as long as its cached connection, so it is dropped by closing it
+        db_path = Path(f"file:kairoscope_test_{uuid.uuid4().hex}?mode=memory&cache=shared")
+        initialize_db(db_path)
+        yield db_path
+        close_db_connections()
+        return
+
     db_path = tmp_path / "test_kairoscope.db"
 
     if db_path.exists():
         db_path.unlink()
 
-    initialize_db(db_path)
+    shutil.copyfile(template_db, db_path)
 
     yield db_path
 
+    # Close the cached connection first, so its file and WAL/SHM descriptors aren't leaked
+    close_db_connections()
     if db_path.exists():
         db_path.unlink()
@@ -2,54 +2,50 @@ import hashlib
 import json
 import os
 import tarfile
+import time
 from pathlib import Path
 from unittest.mock import patch
 
 import pytest
 from click.testing import CliRunner
 
+from kairoscope import api, serialization
 from kairoscope.cli import cli
-from kairoscope.db import get_all_events, get_artifact_metadata_by_hash, initialize_db
+from kairoscope.db import get_all_events, get_artifact_metadata_by_hash, get_db_connection
+from kairoscope.provenance import HASH_CHUNK_SIZE
 
 
 # Mock timestamp for deterministic ledger entries
 @pytest.fixture(autouse=True)
 def mock_timestamp():
-    with patch("kairoscope.cli._get_timestamp", return_value="2025-09-21T12:00:00.000Z"):
+    with patch("kairoscope.api._get_timestamp", return_value="2025-09-21T12:00:00.000Z"):
         yield
 
 
-@pytest.fixture
+@pytest.fixture(scope="module")
 def runner():
-    return CliRunner()
+    # Tests assert on exit codes themselves, so unexpected exceptions should surface as-is
+    return CliRunner(catch_exceptions=False)
 
 
 @pytest.fixture(autouse=True)
-def setup_test_environment(tmp_path):
+def setup_test_environment(tmp_path, monkeypatch, setup_db_for_tests):
     # Change the current working directory to a temporary one for each test
     # This ensures that artifacts/, dist/, kairoscope.key, etc., are created in isolation
-    original_cwd = Path.cwd()
-    Path.cwd = lambda: tmp_path
+    monkeypatch.chdir(tmp_path)
 
     # Set the KAIROSCOPE_DB_PATH environment variable for the test
-    db_path = tmp_path / "test_kairoscope.db"
-    os.environ["KAIROSCOPE_DB_PATH"] = str(db_path)
+    db_path = setup_db_for_tests  # A copy of the template, or an in-memory database
+    monkeypatch.setenv("KAIROSCOPE_DB_PATH", str(db_path))
+    # Tests only check the tarball's contents and hash, so skip the deflate work
+    monkeypatch.setenv("KAIROSCOPE_TAR_COMPRESSLEVEL", "0")
 
     # Ensure directories are created for the test run
     (tmp_path / "artifacts").mkdir(exist_ok=True)
     (tmp_path / "dist").mkdir(exist_ok=True)
 
-    initialize_db(db_path)  # Initialize the database with the temporary path
     yield db_path  # Yield db_path so tests can use it
 
-    # Clean up the database file and environment variable after each test
-    if db_path.exists():
-        db_path.unlink()
-    del os.environ["KAIROSCOPE_DB_PATH"]
-
-    # Restore original cwd after test
-    Path.cwd = lambda: original_cwd
-
 
 def test_capture_command(runner: CliRunner, tmp_path: Path, setup_test_environment: Path):
     db_path = setup_test_environment
@@ -85,6 +81,80 @@ def test_capture_command(runner: CliRunner, tmp_path: Path, setup_test_environme
     assert len(get_all_events(db_path)) == 1  # No new ledger entry
 
 
+def test_capture_answers_unchanged_file_from_path_cache(
+    runner: CliRunner, tmp_path: Path, setup_test_environment: Path, monkeypatch
+):
+    test_file_path = tmp_path / "test_input.txt"
+    test_file_path.write_bytes(b"Hello, Kairoscope!")
+    assert runner.invoke(cli, ["capture", str(test_file_path)]).exit_code == 0
+
+    # An unchanged file is recognised without reading its content again
+    def fail_sha256_file(path):
+        raise AssertionError(f"{path} was hashed again")
+
+    monkeypatch.setattr("kairoscope.api.sha256_file", fail_sha256_file)
+    result = runner.invoke(cli, ["capture", str(test_file_path)])
+    assert result.exit_code == 0
+    assert "Artifact already exists" in result.output
+
+
+@pytest.mark.parametrize("replace", [False, True], ids=["in_place", "renamed"])
+def test_capture_path_cache_invalidated_by_same_size_rewrite(
+    runner: CliRunner, tmp_path: Path, setup_test_environment: Path, replace: bool
+):
+    db_path = setup_test_environment
+    test_file_path = tmp_path / "test_input.txt"
+    test_file_path.write_bytes(b"first version")
+    assert runner.invoke(cli, ["capture", str(test_file_path)]).exit_code == 0
+    original_stat = test_file_path.stat()
+
+    # Rewrite with content of the same size and put the old mtime back, so only the
+    # ctime (in place) or the inode (renamed over) shows the change
+    new_content = b"other version"
+    if replace:
+        replacement_path = tmp_path / "replacement.txt"
+        replacement_path.write_bytes(new_content)
+        replacement_path.replace(test_file_path)
+    else:
+        # Let the coarse kernel clock tick so the rewrite gets a new ctime
+        time.sleep(0.05)
+        test_file_path.write_bytes(new_content)
+    os.utime(test_file_path, ns=(original_stat.st_atime_ns, original_stat.st_mtime_ns))
+
+    result = runner.invoke(cli, ["capture", str(test_file_path)])
+    assert result.exit_code == 0
+    assert "Artifact already exists" not in result.output
+    new_hash = hashlib.sha256(new_content).hexdigest()
+    assert get_artifact_metadata_by_hash(new_hash, db_path) is not None
+    assert (tmp_path / "artifacts" / new_hash).read_bytes() == new_content
+
+
+def test_capture_canonicalizes_existing_record(
+    runner: CliRunner, tmp_path: Path, setup_test_environment: Path
+):
+    db_path = setup_test_environment
+    test_file_content = b"Hello, Kairoscope!"
+    test_file_path = tmp_path / "test_input.txt"
+    test_file_path.write_bytes(test_file_content)
+    content_hash = hashlib.sha256(test_file_content).hexdigest()
+
+    # Earlier versions stored the record with json.dumps defaults: spaces and unsorted keys
+    record = {"kind": "capture", "id": "legacy-id", "uri": f"file://{content_hash}"}
+    record["hash"] = content_hash
+    conn = get_db_connection(db_path)
+    with conn:
+        conn.execute(
+            "INSERT INTO artifacts (id, kind, uri, hash, raw_metadata_json) VALUES (?, ?, ?, ?, ?)",
+            ("legacy-id", "capture", record["uri"], content_hash, json.dumps(record)),
+        )
+    conn.close()
+
+    result = runner.invoke(cli, ["capture", str(test_file_path)])
+    assert result.exit_code == 0
+    assert "Artifact already exists" in result.output
+    assert f"{{'artifact': {serialization.dumps(record, sort_keys=True)}}}" in result.output
+
+
 def test_sign_command(runner: CliRunner, tmp_path: Path, setup_test_environment: Path):
     db_path = setup_test_environment
     test_file_content = b"Hello, Kairoscope!"
@@ -121,6 +191,15 @@ def test_sign_command(runner: CliRunner, tmp_path: Path, setup_test_environment:
     assert len(get_all_events(db_path)) == 2  # No new ledger entry
 
 
+@pytest.fixture(params=["in_memory", "streamed"])
+def tarball_writer(request, monkeypatch) -> str:
+    """Runs an export test both ways: small exports are built in memory, large ones streamed."""
+    if request.param == "streamed":
+        monkeypatch.setattr("kairoscope.api._IN_MEMORY_TARBALL_LIMIT", -1)
+    return request.param
+
+
+@pytest.mark.usefixtures("tarball_writer")
 def test_export_command_happy_path(runner: CliRunner, tmp_path: Path, setup_test_environment: Path):
     db_path = setup_test_environment
     test_file_content = b"Hello, Kairoscope!"
@@ -147,7 +226,7 @@ def test_export_command_happy_path(runner: CliRunner, tmp_path: Path, setup_test
     # Verify tarball contents
     with tarfile.open(output_tarball, "r:gz") as tar:
         tar_members = [m.name for m in tar.getmembers()]
-        assert f"artifacts/{content_hash}" in tar_members
+        assert tar_members == [f"artifacts/{content_hash}"]
 
         # Verify content of the artifact inside the tarball
         extracted_artifact = tar.extractfile(f"artifacts/{content_hash}")
@@ -167,6 +246,113 @@ def test_export_command_happy_path(runner: CliRunner, tmp_path: Path, setup_test
     assert content_hash in export_event["artifacts_exported"]
 
 
+@pytest.mark.usefixtures("tarball_writer")
+def test_export_command_uncompressed_tar(
+    runner: CliRunner, tmp_path: Path, setup_test_environment: Path
+):
+    test_file_content = b"Hello, Kairoscope!" * 100
+    test_file_path = tmp_path / "test_input.txt"
+    test_file_path.write_bytes(test_file_content)
+
+    runner.invoke(cli, ["capture", str(test_file_path)])
+    content_hash = hashlib.sha256(test_file_content).hexdigest()
+    runner.invoke(cli, ["sign", content_hash])
+
+    output_tarball = tmp_path / "dist" / "kairoscope-v0.1.0.tar"
+    checksums_file = tmp_path / "dist" / "SHA256SUMS"
+    result = runner.invoke(
+        cli, ["export", "--output", str(output_tarball), "--checksums", str(checksums_file)]
+    )
+    assert result.exit_code == 0
+
+    with tarfile.open(output_tarball, "r:") as tar:
+        assert tar.getnames() == [f"artifacts/{content_hash}"]
+        extracted_artifact = tar.extractfile(f"artifacts/{content_hash}")
+        assert extracted_artifact is not None
+        assert extracted_artifact.read() == test_file_content
+
+    tarball_hash = hashlib.sha256(output_tarball.read_bytes()).hexdigest()
+    assert checksums_file.read_text() == f"{tarball_hash} {output_tarball.name}\n"
+
+
+@pytest.mark.skipif(not hasattr(os, "sendfile"), reason="os.sendfile is unavailable")
+def test_streamed_tar_matches_tarfile_output(tmp_path: Path, monkeypatch):
+    # Sizes around the 512-byte block boundary, plus one member that needs several sendfile calls
+    members = []
+    for size in [0, 511, 512, 513, 3 * 4096 + 100]:
+        member_path = tmp_path / f"member_{size}.bin"
+        member_path.write_bytes(bytes(i % 251 for i in range(size)))
+        members.append(member_path)
+
+    sendfile = os.sendfile
+    sendfile_counts = []
+
+    def short_sendfile(out_fd: int, in_fd: int, offset: int, count: int) -> int:
+        sendfile_counts.append(count)
+        return sendfile(out_fd, in_fd, offset, min(count, 4096))
+
+    monkeypatch.setattr(os, "sendfile", short_sendfile)
+    streamed = tmp_path / "streamed.tar"
+    with api._open_tarball(streamed, compresslevel=0) as tar:
+        for member_path in members:
+            tar.add(member_path, arcname=f"artifacts/{member_path.name}")
+
+    expected = tmp_path / "expected.tar"
+    with tarfile.open(expected, mode="w") as tar:
+        for member_path in members:
+            tar.add(member_path, arcname=f"artifacts/{member_path.name}")
+
+    assert sendfile_counts[-4:] == [3 * 4096 + 100, 2 * 4096 + 100, 4096 + 100, 100]
+    assert streamed.read_bytes() == expected.read_bytes()
+
+
+@pytest.mark.parametrize("level", ["10", "-1", "fast"])
+def test_export_command_rejects_invalid_compresslevel(
+    runner: CliRunner, tmp_path: Path, setup_test_environment: Path, monkeypatch, level: str
+):
+    test_file_path = tmp_path / "test_input.txt"
+    test_file_path.write_bytes(b"Hello, Kairoscope!")
+    runner.invoke(cli, ["capture", str(test_file_path)])
+    runner.invoke(cli, ["sign", hashlib.sha256(b"Hello, Kairoscope!").hexdigest()])
+
+    monkeypatch.setenv("KAIROSCOPE_TAR_COMPRESSLEVEL", level)
+    output_tarball = tmp_path / "dist" / "kairoscope-v0.1.0.tar.gz"
+    result = runner.invoke(
+        cli,
+        ["export", "--output", str(output_tarball), "--checksums", str(tmp_path / "SHA256SUMS")],
+    )
+    assert result.exit_code != 0
+    assert f"KAIROSCOPE_TAR_COMPRESSLEVEL must be an integer from 0 to 9, got '{level}'" in (
+        result.stderr
+    )
+    assert not output_tarball.exists()
+
+
+def test_export_command_blocked_by_tampered_artifact(
+    runner: CliRunner, tmp_path: Path, setup_test_environment: Path
+):
+    db_path = setup_test_environment
+    test_file_content = b"Hello, Kairoscope!"
+    test_file_path = tmp_path / "test_input.txt"
+    test_file_path.write_bytes(test_file_content)
+
+    runner.invoke(cli, ["capture", str(test_file_path)])
+    content_hash = hashlib.sha256(test_file_content).hexdigest()
+    runner.invoke(cli, ["sign", content_hash])
+
+    # Modify the stored artifact after it was captured and signed
+    (tmp_path / "artifacts" / content_hash).write_bytes(b"Tampered content")
+
+    output_tarball = tmp_path / "dist" / "kairoscope-v0.1.0.tar.gz"
+    result = runner.invoke(
+        cli, ["export", "--output", str(output_tarball), "--checksums", str(tmp_path / "SUMS")]
+    )
+    assert result.exit_code != 0
+    assert "does not match its recorded hash" in result.stderr
+    assert not output_tarball.exists()
+    assert len(get_all_events(db_path)) == 2  # Capture + Sign, no export
+
+
 def test_ledger_command_show(runner: CliRunner, tmp_path: Path, setup_test_environment: Path):
     db_path = setup_test_environment
     test_file_content = b"Hello, Kairoscope!"
@@ -181,8 +367,10 @@ def test_ledger_command_show(runner: CliRunner, tmp_path: Path, setup_test_envir
     assert result.exit_code == 0
     events = get_all_events(db_path)
     assert len(events) == 2
-    assert json.dumps(events[0], sort_keys=True) in result.output
-    assert json.dumps(events[1], sort_keys=True) in result.output
+    # One line of compact, sorted-key JSON per event, in ledger order
+    assert result.output.splitlines() == [
+        serialization.dumps(event, sort_keys=True) for event in events
+    ]
 
 
 def test_ledger_command_empty(runner: CliRunner, tmp_path: Path, setup_test_environment: Path):
@@ -214,3 +402,19 @@ def test_capture_from_stdin(runner: CliRunner, tmp_path: Path, setup_test_enviro
     capture_event = events[0]
     assert capture_event["action"] == "capture"
     assert capture_event["artifact_hash"] == content_hash
+
+
+def test_capture_from_stdin_records_content_hash(
+    runner: CliRunner, tmp_path: Path, setup_test_environment: Path
+):
+    # Spans several copy_and_hash chunks, with a partial final chunk
+    test_content = os.urandom(HASH_CHUNK_SIZE * 2 + 12345)
+    expected_hash = hashlib.sha256(test_content).hexdigest()
+
+    result = runner.invoke(cli, ["capture"], input=test_content)
+    assert result.exit_code == 0
+
+    events = get_all_events(setup_test_environment)
+    assert [event["artifact_hash"] for event in events] == [expected_hash]
+    assert (tmp_path / "artifacts" / expected_hash).read_bytes() == test_content
+    assert f'"hash":"{expected_hash}"' in result.output
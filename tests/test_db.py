@@ -1,13 +1,27 @@
+import json
 from pathlib import Path
 
 from kairoscope.db import (
+    SCHEMA_VERSION,
+    cache_path_hash,
+    count_unsigned_artifacts,
+    delete_tpm_key,
     get_all_artifact_hashes,
+    get_all_event_json,
     get_all_events,
+    get_all_tpm_keys,
     get_artifact_metadata_by_hash,
     get_artifact_metadata_by_id,
+    get_cached_path_hash,
     get_db_connection,
+    get_sign_events,
+    get_tpm_key,
+    initialize_db,
     insert_artifact_metadata,
+    insert_artifact_metadata_bulk,
     insert_event,
+    insert_events_bulk,
+    insert_tpm_key,
 )
 
 
@@ -22,7 +36,49 @@ def test_db_initialization(setup_db_for_tests: Path):
     assert "events" in tables
     assert "artifacts" in tables
 
+    # Hash lookups are served from the covering index without touching the table
+    plan = cursor.execute(
+        "EXPLAIN QUERY PLAN SELECT raw_metadata_json FROM artifacts "
+        "INDEXED BY idx_artifacts_hash_cover WHERE hash = ?",
+        ("h",),
+    ).fetchall()
+    assert "COVERING INDEX idx_artifacts_hash_cover" in plan[0][-1]
+
+    conn.close()
+
+
+def test_db_initialization_is_versioned(setup_db_for_tests: Path):
+    db_path = setup_db_for_tests
+    insert_event({"ts": "2025-09-21T10:00:00.000Z", "action": "capture", "by": "a"}, db_path)
+
+    # Re-initializing an up-to-date database is a no-op that keeps existing data
+    initialize_db(db_path)
+
+    conn = get_db_connection(db_path)
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
     conn.close()
+    assert len(get_all_events(db_path)) == 1
+
+
+def test_db_upgrade_canonicalizes_stored_events(setup_db_for_tests: Path):
+    db_path = setup_db_for_tests
+    event = {"ts": "2025-09-21T10:00:00.000Z", "action": "capture", "by": "a"}
+    # A row as written before schema 5, and a database stamped with the previous version
+    conn = get_db_connection(db_path)
+    with conn:
+        conn.execute(
+            "INSERT INTO events (timestamp, action, by, raw_event_json) VALUES (?, ?, ?, ?)",
+            (event["ts"], event["action"], event["by"], json.dumps(event)),
+        )
+        conn.execute("PRAGMA user_version = 4")
+    conn.close()
+
+    initialize_db(db_path)
+
+    assert get_all_event_json(db_path) == [
+        '{"action":"capture","by":"a","ts":"2025-09-21T10:00:00.000Z"}'
+    ]
+    assert get_all_events(db_path) == [event]
 
 
 def test_insert_and_get_event(setup_db_for_tests: Path):
@@ -66,6 +122,49 @@ def test_insert_and_get_event(setup_db_for_tests: Path):
     assert retrieved_export_event["slsa_generated"] is False
 
 
+def test_insert_events_bulk(setup_db_for_tests: Path):
+    db_path = setup_db_for_tests
+    insert_events_bulk(
+        [
+            {
+                "ts": "2025-09-21T10:00:00.000Z",
+                "action": "capture",
+                "by": "a",
+                "artifact_hash": "h1",
+            },
+            {"ts": "2025-09-21T10:01:00.000Z", "action": "sign", "by": "a", "artifact_hash": "h1"},
+        ],
+        db_path,
+    )
+
+    events = get_all_events(db_path)
+    assert [e["action"] for e in events] == ["capture", "sign"]
+    assert all(e["artifact_hash"] == "h1" for e in events)
+
+
+def test_get_sign_events(setup_db_for_tests: Path):
+    db_path = setup_db_for_tests
+    ts = "2025-09-21T10:00:00.000Z"
+    insert_events_bulk(
+        [
+            {"ts": ts, "action": "capture", "by": "a", "artifact_hash": "h1"},
+            {
+                "ts": ts,
+                "action": "sign",
+                "by": "a",
+                "artifact_hash": "h1",
+                "artifact_signature": "s1",
+            },
+            # Sign events without a signature can't be verified and are left out
+            {"ts": ts, "action": "sign", "by": "a", "artifact_hash": "h2"},
+        ],
+        db_path,
+    )
+
+    assert get_sign_events(["h1", "h2"], db_path) == [("h1", "s1", "a")]
+    assert get_sign_events(["h2"], db_path) == []
+
+
 def test_insert_and_get_artifact_metadata(setup_db_for_tests: Path):
     db_path = setup_db_for_tests
     metadata = {
@@ -109,3 +208,102 @@ def test_get_all_artifact_hashes(setup_db_for_tests: Path):
     assert len(hashes) == 2
     assert "h1" in hashes
     assert "h2" in hashes
+
+
+def test_insert_artifact_metadata_bulk(setup_db_for_tests: Path):
+    db_path = setup_db_for_tests
+    insert_artifact_metadata({"id": "id1", "kind": "k", "uri": "u", "hash": "h1"}, db_path)
+    insert_artifact_metadata_bulk(
+        [
+            {"id": "id1", "kind": "k", "uri": "u", "hash": "h1", "c2pa_assertion": "a"},
+            {"id": "id2", "kind": "k", "uri": "u", "hash": "h2"},
+            {"id": "id3", "kind": "k", "uri": "u", "hash": "h3"},
+        ],
+        db_path,
+    )
+
+    # Rows with an existing id are replaced, the rest are added
+    assert sorted(get_all_artifact_hashes(db_path)) == ["h1", "h2", "h3"]
+    retrieved = get_artifact_metadata_by_id("id1", db_path)
+    assert retrieved is not None
+    assert retrieved["c2pa_assertion"] == "a"
+    assert get_artifact_metadata_by_hash("h3", db_path) == {
+        "id": "id3",
+        "kind": "k",
+        "uri": "u",
+        "hash": "h3",
+    }
+
+    insert_artifact_metadata_bulk([], db_path)
+    assert len(get_all_artifact_hashes(db_path)) == 3
+
+
+def test_count_unsigned_artifacts(setup_db_for_tests: Path):
+    db_path = setup_db_for_tests
+    insert_artifact_metadata({"id": "id1", "kind": "k", "uri": "u", "hash": "h1"}, db_path)
+    insert_artifact_metadata(
+        {"id": "id2", "kind": "k", "uri": "u", "hash": "h2", "c2pa_assertion": "a"}, db_path
+    )
+
+    assert count_unsigned_artifacts(["h1", "h2"], db_path) == 1
+    assert count_unsigned_artifacts(["h2"], db_path) == 0
+
+
+def test_artifact_lookup_sees_writes_from_other_connections(setup_db_for_tests: Path):
+    db_path = setup_db_for_tests
+    assert get_artifact_metadata_by_hash("h1", db_path) is None
+
+    # Written by another connection, as another process would
+    conn = get_db_connection(db_path)
+    with conn:
+        conn.execute(
+            "INSERT INTO artifacts (id, kind, uri, hash, raw_metadata_json) VALUES (?, ?, ?, ?, ?)",
+            ("id1", "k", "u", "h1", '{"hash":"h1","id":"id1","kind":"k","uri":"u"}'),
+        )
+    assert get_artifact_metadata_by_hash("h1", db_path) == {
+        "hash": "h1",
+        "id": "id1",
+        "kind": "k",
+        "uri": "u",
+    }
+
+    with conn:
+        conn.execute(
+            "UPDATE artifacts SET raw_metadata_json = ? WHERE hash = ?",
+            ('{"c2pa_assertion":"a","hash":"h1","id":"id1","kind":"k","uri":"u"}', "h1"),
+        )
+    conn.close()
+    updated = get_artifact_metadata_by_hash("h1", db_path)
+    assert updated is not None
+    assert updated["c2pa_assertion"] == "a"
+
+
+def test_path_hash_cache(setup_db_for_tests: Path):
+    db_path = setup_db_for_tests
+    cache_path_hash("/data/a.bin", 100, 5, 300, 7, "h1", db_path)
+
+    assert get_cached_path_hash("/data/a.bin", 100, 5, 300, 7, db_path) == "h1"
+    # A changed mtime, size, ctime or inode invalidates the entry
+    assert get_cached_path_hash("/data/a.bin", 200, 5, 300, 7, db_path) is None
+    assert get_cached_path_hash("/data/a.bin", 100, 6, 300, 7, db_path) is None
+    assert get_cached_path_hash("/data/a.bin", 100, 5, 400, 7, db_path) is None
+    assert get_cached_path_hash("/data/a.bin", 100, 5, 300, 8, db_path) is None
+
+    cache_path_hash("/data/a.bin", 200, 6, 400, 8, "h2", db_path)
+    assert get_cached_path_hash("/data/a.bin", 200, 6, 400, 8, db_path) == "h2"
+
+
+def test_tpm_key_index(setup_db_for_tests: Path):
+    db_path = setup_db_for_tests
+    insert_tpm_key("sha256:k1", 0x81000001, "default-tpm-key", "ES384", b"pem1", db_path)
+    insert_tpm_key("sha256:k2", 0x81000002, "release", "ES384", b"pem2", db_path)
+
+    record = get_tpm_key("sha256:k1", db_path)
+    assert record is not None
+    assert record["persistent_handle"] == 0x81000001
+    assert record["pem"] == b"pem1"
+    assert [k["key_id"] for k in get_all_tpm_keys(db_path)] == ["sha256:k1", "sha256:k2"]
+
+    delete_tpm_key("sha256:k1", db_path)
+    assert get_tpm_key("sha256:k1", db_path) is None
+    assert [k["label"] for k in get_all_tpm_keys(db_path)] == ["release"]
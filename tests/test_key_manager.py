@@ -0,0 +1,74 @@
+import hashlib
+from pathlib import Path
+
+import pytest
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519
+
+from kairoscope.key_manager import FileKeyBackend
+
+DIGESTS = [hashlib.sha256(f"artifact {i}".encode()).digest() for i in range(4)]
+
+
+def test_ed25519_sign_and_verify(tmp_path: Path):
+    backend = FileKeyBackend(key_dir=tmp_path)
+    key_id, _ = backend.generate_key_pair(curve="Ed25519")
+    assert isinstance(backend.get_public_key(key_id), ed25519.Ed25519PublicKey)
+    assert backend.get_algorithm(key_id) == "EdDSA"
+    assert backend.list_keys()[0]["type"] == "Ed25519"
+
+    signature = backend.sign_digest(key_id, DIGESTS[0])
+    verify = backend.get_verifier(key_id)
+    assert backend.verify_signature(key_id, signature, DIGESTS[0])
+    assert verify(signature, DIGESTS[0])
+    assert not verify(signature, DIGESTS[1])
+    assert not verify(b"malformed", DIGESTS[0])
+
+
+@pytest.mark.parametrize("curve", ["Ed25519", "P384"])
+def test_sign_many(tmp_path: Path, curve: str):
+    backend = FileKeyBackend(key_dir=tmp_path)
+    key_id, _ = backend.generate_key_pair(curve=curve)
+
+    signatures = backend.sign_many(key_id, DIGESTS)
+    assert len(signatures) == len(DIGESTS)
+    verify = backend.get_verifier(key_id)
+    assert all(
+        verify(signature, digest) for signature, digest in zip(signatures, DIGESTS, strict=True)
+    )
+
+
+def test_generate_key_pair_honours_curve(tmp_path: Path):
+    backend = FileKeyBackend(key_dir=tmp_path)
+    key_id, _ = backend.generate_key_pair(curve="P384")
+    public_key = backend.get_public_key(key_id)
+    assert isinstance(public_key, ec.EllipticCurvePublicKey)
+    assert isinstance(public_key.curve, ec.SECP384R1)
+    assert backend.get_algorithm(key_id) == "ES384"
+    assert backend.list_keys()[0]["type"] == "ECC"
+
+    with pytest.raises(ValueError):
+        FileKeyBackend(key_dir=tmp_path / "other").generate_key_pair(curve="P256")
+
+
+def test_existing_p384_key_verifies_its_signatures(tmp_path: Path):
+    # Key files written before Ed25519 became the default are loaded as-is
+    private_key = ec.generate_private_key(ec.SECP384R1())
+    (tmp_path / "kairoscope.key").write_bytes(
+        private_key.private_bytes(
+            encoding=serialization.Encoding.PEM,
+            format=serialization.PrivateFormat.PKCS8,
+            encryption_algorithm=serialization.NoEncryption(),
+        )
+    )
+    signature = private_key.sign(DIGESTS[0], ec.ECDSA(hashes.SHA256()))
+
+    backend = FileKeyBackend(key_dir=tmp_path)
+    key_id, _ = backend.generate_key_pair(curve="Ed25519")
+    assert backend.get_public_key_pem(key_id) == private_key.public_key().public_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PublicFormat.SubjectPublicKeyInfo,
+    ).decode("utf-8")
+    assert backend.verify_signature(key_id, signature, DIGESTS[0])
+    assert backend.get_verifier(key_id)(signature, DIGESTS[0])
+    assert not backend.get_verifier(key_id)(signature, DIGESTS[1])
@@ -1,65 +1,57 @@
 import hashlib
-import os
 from pathlib import Path
 from unittest.mock import patch
 
 import pytest
 from click.testing import CliRunner
 
+from kairoscope import api
 from kairoscope.cli import cli
-from kairoscope.db import get_all_events, initialize_db, insert_event
+from kairoscope.db import get_all_events, insert_event
+from kairoscope.key_manager import FileKeyBackend
 from kairoscope.policy import get_policy_file
-from kairoscope.provenance import get_public_key_fingerprint
+from kairoscope.provenance import get_public_key_fingerprint, set_key_manager
 
 
 # Mock timestamp for deterministic ledger entries
 @pytest.fixture(autouse=True)
 def mock_timestamp():
-    with patch("kairoscope.cli._get_timestamp", return_value="2025-09-21T12:00:00.000Z"):
+    with patch("kairoscope.api._get_timestamp", return_value="2025-09-21T12:00:00.000Z"):
         yield
 
 
-@pytest.fixture
+@pytest.fixture(scope="module")
 def runner():
-    return CliRunner()
+    # Tests assert on exit codes themselves, so unexpected exceptions should surface as-is
+    return CliRunner(catch_exceptions=False)
 
 
 @pytest.fixture(autouse=True)
-def setup_test_environment(tmp_path):
+def setup_test_environment(tmp_path, monkeypatch, setup_db_for_tests):
     # Change the current working directory to a temporary one for each test
     # This ensures that artifacts/, dist/, kairoscope.key, etc., are created in isolation
-    original_cwd = Path.cwd()
-    Path.cwd = lambda: tmp_path
+    monkeypatch.chdir(tmp_path)
 
     # Set the KAIROSCOPE_DB_PATH environment variable for the test
-    db_path = tmp_path / "test_kairoscope.db"
-    os.environ["KAIROSCOPE_DB_PATH"] = str(db_path)
+    db_path = setup_db_for_tests  # A copy of the template, or an in-memory database
+    monkeypatch.setenv("KAIROSCOPE_DB_PATH", str(db_path))
 
     # Ensure directories are created for the test run
     (tmp_path / "artifacts").mkdir(exist_ok=True)
     (tmp_path / "dist").mkdir(exist_ok=True)
 
-    initialize_db(db_path)  # Initialize the database with the temporary path
     yield db_path  # Yield db_path so tests can use it
 
-    # Clean up the database file and environment variable after each test
-    if db_path.exists():
-        db_path.unlink()
-    del os.environ["KAIROSCOPE_DB_PATH"]
 
-    # Restore original cwd after test
-    Path.cwd = lambda: original_cwd
-
-
-def _capture_and_sign_artifact(
-    runner: CliRunner, tmp_path: Path, content: bytes, db_path: Path
-) -> str:
+def _capture_and_sign_artifact(tmp_path: Path, content: bytes, db_path: Path) -> str:
     test_file_path = tmp_path / "test_input.txt"
     test_file_path.write_bytes(content)
 
-    runner.invoke(cli, ["capture", str(test_file_path)])
-    content_hash = hashlib.sha256(content).hexdigest()
-    runner.invoke(cli, ["sign", content_hash])
+    # Capture and sign through the API directly; only export goes through the CLI
+    set_key_manager(FileKeyBackend())
+    content_hash, _, _ = api.capture(test_file_path, db_path)
+    assert content_hash == hashlib.sha256(content).hexdigest()
+    api.sign(content_hash, db_path)
     return content_hash
 
 
@@ -118,7 +110,7 @@ def test_export_command_universal_rule(
 ):
     db_path = setup_test_environment
     test_file_content = b"Content for universal rule test."
-    _capture_and_sign_artifact(runner, tmp_path, test_file_content, db_path)
+    _capture_and_sign_artifact(tmp_path, test_file_content, db_path)
 
     # Define a policy that requires a 'ledger' validator, which is not explicitly met here
     policy_file = get_policy_file()
@@ -151,7 +143,7 @@ def test_export_command_threshold_rule(
 ):
     db_path = setup_test_environment
     test_file_content = b"Content for threshold rule test."
-    content_hash = _capture_and_sign_artifact(runner, tmp_path, test_file_content, db_path)
+    content_hash = _capture_and_sign_artifact(tmp_path, test_file_content, db_path)
 
     # Simulate a second attestor
     second_attestor_fingerprint = "sha256:second_attestor_fingerprint"
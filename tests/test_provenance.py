@@ -0,0 +1,84 @@
+import hashlib
+from pathlib import Path
+
+import pytest
+from click.testing import CliRunner
+
+from kairoscope.cli import key
+from kairoscope.key_manager import FileKeyBackend
+from kairoscope.provenance import (
+    PROCESS_POOL_MIN_FILES,
+    get_active_key_manager,
+    get_public_key_fingerprint,
+    set_key_manager,
+    sha256_file,
+    sha256_many,
+    sign_bytes,
+    verify_signature,
+)
+
+
+def _write_files(directory: Path, count: int) -> list[Path]:
+    # Varied sizes, including an empty file, so the largest-first ordering is exercised
+    paths = []
+    for i in range(count):
+        path = directory / f"file_{i}.bin"
+        path.write_bytes(bytes([i % 256]) * (i * 997 % 5000))
+        paths.append(path)
+    return paths
+
+
+@pytest.mark.parametrize(
+    "count",
+    [0, 1, 2, PROCESS_POOL_MIN_FILES - 1, PROCESS_POOL_MIN_FILES],
+    ids=["empty", "single", "threads", "threads_at_threshold", "processes"],
+)
+def test_sha256_many_matches_sha256_file(tmp_path: Path, count: int):
+    paths = _write_files(tmp_path, count)
+    expected = [hashlib.sha256(path.read_bytes()).hexdigest() for path in paths]
+    assert [sha256_file(path) for path in paths] == expected
+    assert sha256_many(paths) == expected
+
+
+@pytest.mark.parametrize("count", [2, PROCESS_POOL_MIN_FILES], ids=["threads", "processes"])
+def test_sha256_many_missing_file(tmp_path: Path, count: int):
+    paths = _write_files(tmp_path, count)
+    missing = tmp_path / "missing.bin"
+    paths.insert(count // 2, missing)
+
+    with pytest.raises(FileNotFoundError) as exc_info:
+        sha256_many(paths)
+    assert exc_info.value.filename == str(missing)
+
+
+@pytest.fixture
+def signed_with_old_key(tmp_path: Path) -> tuple[bytes, str]:
+    """Signs with a fresh file key and verifies once, so the key's verifier is cached."""
+    set_key_manager(FileKeyBackend(key_dir=tmp_path))
+    signature = sign_bytes(b"artifact")
+    assert verify_signature(signature, b"artifact")
+    return signature, get_public_key_fingerprint()
+
+
+def test_key_delete_invalidates_cached_verifier(signed_with_old_key: tuple[bytes, str]):
+    signature, old_key_id = signed_with_old_key
+    # The key group is invoked on its own, so the active KeyManager is not replaced
+    result = CliRunner(catch_exceptions=False).invoke(key, ["delete", old_key_id])
+    assert result.exit_code == 0
+
+    assert not verify_signature(signature, b"artifact")
+    assert get_public_key_fingerprint() != old_key_id
+
+
+def test_key_generate_invalidates_cached_verifier(signed_with_old_key: tuple[bytes, str]):
+    signature, old_key_id = signed_with_old_key
+    # Delete the key through the backend rather than the CLI, so only generate invalidates
+    get_active_key_manager().delete_key(old_key_id)
+    result = CliRunner(catch_exceptions=False).invoke(key, ["generate"])
+    assert result.exit_code == 0
+    assert "Generated key with ID" in result.output
+
+    new_key_id = get_public_key_fingerprint()
+    assert new_key_id != old_key_id
+    assert not verify_signature(signature, b"artifact")
+    assert verify_signature(sign_bytes(b"artifact"), b"artifact")
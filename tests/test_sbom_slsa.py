@@ -1,71 +1,95 @@
 import hashlib
 import json
+import logging
 import os
+import shutil
 from pathlib import Path
 from unittest.mock import patch
 
 import pytest
 from click.testing import CliRunner
 
+from kairoscope import api, sbom
 from kairoscope.cli import cli
-from kairoscope.db import get_all_events, initialize_db
+from kairoscope.db import get_all_events, get_db_connection
+from kairoscope.key_manager import FileKeyBackend
+from kairoscope.provenance import set_key_manager
 
 
 # Mock timestamp for deterministic ledger entries
 @pytest.fixture(autouse=True)
 def mock_timestamp():
-    with patch("kairoscope.cli._get_timestamp", return_value="2025-09-21T12:00:00.000Z"):
+    with patch("kairoscope.api._get_timestamp", return_value="2025-09-21T12:00:00.000Z"):
         yield
 
 
-@pytest.fixture
+@pytest.fixture(scope="module")
 def runner():
-    return CliRunner()
+    # Tests assert on exit codes themselves, so unexpected exceptions should surface as-is
+    return CliRunner(catch_exceptions=False)
+
+
+def _capture_and_sign_artifact(tmp_path: Path, content: bytes, db_path: Path) -> str:
+    test_file_path = tmp_path / "test_input.txt"
+    test_file_path.write_bytes(content)
+
+    # Capture and sign through the API directly; only export goes through the CLI
+    set_key_manager(FileKeyBackend())
+    content_hash, _, _ = api.capture(test_file_path, db_path)
+    assert content_hash == hashlib.sha256(content).hexdigest()
+    api.sign(content_hash, db_path)
+    return content_hash
+
+
+@pytest.fixture(scope="module")
+def signed_workspace(tmp_path_factory, template_db):
+    # Capture and sign one artifact per module; each test starts from a copy of the result
+    # and only varies its export flags
+    workspace = tmp_path_factory.mktemp("signed")
+    db_path = workspace / "test_kairoscope.db"
+    shutil.copyfile(template_db, db_path)
+    with pytest.MonkeyPatch.context() as mp:
+        mp.chdir(workspace)
+        mp.setattr("kairoscope.api._get_timestamp", lambda: "2025-09-21T12:00:00.000Z")
+        (workspace / "artifacts").mkdir()
+        _capture_and_sign_artifact(workspace, b"Content for SBOM and SLSA tests.", db_path)
+    return workspace
 
 
 @pytest.fixture(autouse=True)
-def setup_test_environment(tmp_path):
+def setup_test_environment(tmp_path, monkeypatch, setup_db_for_tests, signed_workspace):
     # Change the current working directory to a temporary one for each test
     # This ensures that artifacts/, dist/, kairoscope.key, etc., are created in isolation
-    original_cwd = Path.cwd()
-    Path.cwd = lambda: tmp_path
+    monkeypatch.chdir(tmp_path)
 
     # Set the KAIROSCOPE_DB_PATH environment variable for the test
-    db_path = tmp_path / "test_kairoscope.db"
-    os.environ["KAIROSCOPE_DB_PATH"] = str(db_path)
+    db_path = setup_db_for_tests  # A copy of the template, or an in-memory database
+    monkeypatch.setenv("KAIROSCOPE_DB_PATH", str(db_path))
+    # Tests only check the tarball's contents and hash, so skip the deflate work
+    monkeypatch.setenv("KAIROSCOPE_TAR_COMPRESSLEVEL", "0")
+
+    # Start from the signed artifact: its content, the signing key and its ledger rows
+    shutil.copytree(
+        signed_workspace,
+        tmp_path,
+        dirs_exist_ok=True,
+        ignore=shutil.ignore_patterns("test_kairoscope.db*"),
+    )
+    source = get_db_connection(signed_workspace / "test_kairoscope.db")
+    target = get_db_connection(db_path)
+    source.backup(target)
+    source.close()
+    target.close()
 
     # Ensure directories are created for the test run
     (tmp_path / "artifacts").mkdir(exist_ok=True)
     (tmp_path / "dist").mkdir(exist_ok=True)
 
-    initialize_db(db_path)  # Initialize the database with the temporary path
     yield db_path  # Yield db_path so tests can use it
 
-    # Clean up the database file and environment variable after each test
-    if db_path.exists():
-        db_path.unlink()
-    del os.environ["KAIROSCOPE_DB_PATH"]
-
-    # Restore original cwd after test
-    Path.cwd = lambda: original_cwd
-
-
-def _capture_and_sign_artifact(
-    runner: CliRunner, tmp_path: Path, content: bytes, db_path: Path
-) -> str:
-    test_file_path = tmp_path / "test_input.txt"
-    test_file_path.write_bytes(content)
-
-    runner.invoke(cli, ["capture", str(test_file_path)])
-    content_hash = hashlib.sha256(content).hexdigest()
-    runner.invoke(cli, ["sign", content_hash])
-    return content_hash
-
 
 def test_export_with_sbom(runner: CliRunner, tmp_path: Path, setup_test_environment: Path):
     db_path = setup_test_environment
-    _capture_and_sign_artifact(runner, tmp_path, b"Content for SBOM test.", db_path)
-
     output_tarball = tmp_path / "dist" / "kairoscope-v0.1.0.tar.gz"
     sbom_output_path = tmp_path / "dist" / "kairoscope-v0.1.0.tar.sbom.json"
 
@@ -101,9 +125,6 @@ def test_export_with_sbom(runner: CliRunner, tmp_path: Path, setup_test_environm
 
 def test_export_with_slsa(runner: CliRunner, tmp_path: Path, setup_test_environment: Path):
     db_path = setup_test_environment
-    test_content = b"Content for SLSA test."
-    _capture_and_sign_artifact(runner, tmp_path, test_content, db_path)
-
     output_tarball = tmp_path / "dist" / "kairoscope-v0.1.0.tar.gz"
     slsa_output_path = tmp_path / "dist" / "kairoscope-v0.1.0.tar.slsa.json"
 
@@ -142,9 +163,6 @@ def test_export_with_slsa(runner: CliRunner, tmp_path: Path, setup_test_environm
 
 def test_export_with_sbom_and_slsa(runner: CliRunner, tmp_path: Path, setup_test_environment: Path):
     db_path = setup_test_environment
-    test_content = b"Content for both SBOM and SLSA test."
-    _capture_and_sign_artifact(runner, tmp_path, test_content, db_path)
-
     output_tarball = tmp_path / "dist" / "kairoscope-v0.1.0.tar.gz"
     sbom_output_path = tmp_path / "dist" / "kairoscope-v0.1.0.tar.sbom.json"
     slsa_output_path = tmp_path / "dist" / "kairoscope-v0.1.0.tar.slsa.json"
@@ -187,3 +205,58 @@ def test_export_with_sbom_and_slsa(runner: CliRunner, tmp_path: Path, setup_test
     assert export_event["action"] == "export"
     assert export_event["sbom_generated"] is True
     assert export_event["slsa_generated"] is True
+
+
+def test_run_cyclonedx_keeps_application_log_handlers(tmp_path: Path, monkeypatch):
+    cyclonedx_cli = pytest.importorskip("cyclonedx_py._internal.cli")
+    logger = logging.getLogger("CDX")
+    application_handler = logging.NullHandler()
+    logger.addHandler(application_handler)
+    handlers_before = list(logger.handlers)
+
+    def run(argv: list[str]) -> int:
+        # Like cyclonedx-py, attach a new handler on every call
+        logger.addHandler(logging.StreamHandler())
+        return 0
+
+    monkeypatch.setattr(cyclonedx_cli, "run", run)
+    try:
+        for _ in range(2):
+            sbom._run_cyclonedx(tmp_path / "sbom.json")
+        assert logger.handlers == handlers_before
+    finally:
+        logger.removeHandler(application_handler)
+
+
+def test_generate_sbom_cached_until_environment_changes(tmp_path: Path, monkeypatch):
+    runs: list[Path] = []
+
+    def run_cyclonedx(output_path: Path) -> None:
+        runs.append(output_path)
+        output_path.write_text(f'{{"run": {len(runs)}}}')
+
+    monkeypatch.setattr(sbom, "_run_cyclonedx", run_cyclonedx)
+    monkeypatch.setattr(sbom, "_sbom_cache", {})
+    site_dir = tmp_path / "site-packages"
+    site_dir.mkdir()
+    monkeypatch.syspath_prepend(str(site_dir))
+    # Entries that don't exist are skipped rather than failing the export
+    monkeypatch.syspath_prepend(str(tmp_path / "missing"))
+
+    sbom.generate_sbom(tmp_path / "first.json")
+    sbom.generate_sbom(tmp_path / "second.json")
+    assert len(runs) == 1
+    assert (tmp_path / "second.json").read_text() == '{"run": 1}'
+
+    # Installing a distribution adds its .dist-info directory, changing the directory's mtime
+    os.utime(site_dir, ns=(0, 0))
+    sbom.generate_sbom(tmp_path / "third.json")
+    assert len(runs) == 2
+
+    # So does adding a directory to sys.path
+    other_dir = tmp_path / "other-site-packages"
+    other_dir.mkdir()
+    monkeypatch.syspath_prepend(str(other_dir))
+    sbom.generate_sbom(tmp_path / "fourth.json")
+    assert len(runs) == 3
+    assert (tmp_path / "fourth.json").read_text() == '{"run": 3}'
@@ -0,0 +1,246 @@
+import hashlib
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any
+
+import pytest
+from click.testing import CliRunner
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec, utils
+from tpm2_pytss.constants import TPM2_HC, TPM2_RC
+from tpm2_pytss.exceptions import TPM2_Exception
+
+from kairoscope import api, tpm_key_manager
+from kairoscope.cli import cli
+from kairoscope.db import get_all_tpm_keys, insert_event, insert_tpm_key
+from kairoscope.policy import PARALLEL_VERIFY_MIN_SIGNATURES, can_export
+from kairoscope.provenance import set_key_manager
+from kairoscope.tpm_key_manager import (
+    DEFAULT_TPM_KEY_LABEL,
+    LEGACY_PERSISTENT_HANDLE,
+    TpmKeyBackend,
+    _fingerprint_from_der,
+)
+
+PERSISTENT_HANDLE = TPM2_HC.PERSISTENT_FIRST
+ECDSA_PREHASHED_SHA256 = ec.ECDSA(utils.Prehashed(hashes.SHA256()))
+
+
+def _key_id(private_key: ec.EllipticCurvePrivateKey) -> str:
+    return _fingerprint_from_der(
+        private_key.public_key().public_bytes(
+            serialization.Encoding.DER, serialization.PublicFormat.SubjectPublicKeyInfo
+        )
+    )
+
+
+class _Structure:
+    """Accepts any TPM structure construction the backend performs."""
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        pass
+
+    def __getattr__(self, name: str) -> "_Structure":
+        return self
+
+    def __call__(self, *args: Any, **kwargs: Any) -> "_Structure":
+        return self
+
+    def __or__(self, other: Any) -> "_Structure":
+        return self
+
+
+class _Public:
+    def __init__(self, private_key: ec.EllipticCurvePrivateKey):
+        self._public_key = private_key.public_key()
+
+    def to_pem(self) -> bytes:
+        return self._public_key.public_bytes(
+            serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo
+        )
+
+    def to_der(self) -> bytes:
+        return self._public_key.public_bytes(
+            serialization.Encoding.DER, serialization.PublicFormat.SubjectPublicKeyInfo
+        )
+
+
+class FakeEsapi:
+    """An ESAPI connection to a TPM holding persistent_keys, for the commands the backend uses."""
+
+    def __init__(self, persistent_keys: dict[int, ec.EllipticCurvePrivateKey]):
+        self.persistent_keys = persistent_keys
+        # Handles another TPM user persists a key at just before the backend tries them
+        self.taken_concurrently: set[int] = set()
+        self._created: ec.EllipticCurvePrivateKey | None = None
+
+    def __getattr__(self, name: str) -> _Structure:
+        return _Structure()
+
+    def readpublic(self, objectHandle: int) -> SimpleNamespace:
+        if objectHandle not in self.persistent_keys:
+            raise TPM2_Exception(TPM2_RC.HANDLE)
+        return SimpleNamespace(outPublic=_Public(self.persistent_keys[objectHandle]))
+
+    def get_capability(self, capability: int, prop: int, count: int) -> tuple[bool, Any]:
+        handles = sorted(handle for handle in self.persistent_keys if handle >= prop)
+        data = SimpleNamespace(handles=handles[:count])
+        return len(handles) > count, SimpleNamespace(data=data)
+
+    def create(self, **kwargs: Any) -> SimpleNamespace:
+        self._created = ec.generate_private_key(ec.SECP384R1())
+        return SimpleNamespace(outPrivate=None, outPublic=None)
+
+    def load(self, **kwargs: Any) -> SimpleNamespace:
+        return SimpleNamespace(handle=0x80000000)
+
+    def evictcontrol(self, auth: int, objectHandle: int, persistentHandle: int) -> SimpleNamespace:
+        if persistentHandle in self.taken_concurrently:
+            self.taken_concurrently.discard(persistentHandle)
+            self.persistent_keys[persistentHandle] = ec.generate_private_key(ec.SECP384R1())
+        if persistentHandle in self.persistent_keys:
+            raise TPM2_Exception(TPM2_RC.NV_DEFINED)
+        assert self._created is not None
+        self.persistent_keys[persistentHandle] = self._created
+        return SimpleNamespace(persistentHandle=persistentHandle)
+
+
+@pytest.fixture(autouse=True)
+def setup_test_environment(tmp_path, monkeypatch, setup_db_for_tests):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("KAIROSCOPE_DB_PATH", str(setup_db_for_tests))
+    monkeypatch.setenv("KAIROSCOPE_TAR_COMPRESSLEVEL", "0")
+    (tmp_path / "artifacts").mkdir()
+    (tmp_path / "dist").mkdir()
+    yield setup_db_for_tests
+
+
+@pytest.fixture
+def tpm_private_key() -> ec.EllipticCurvePrivateKey:
+    # Stands in for the key held by the TPM
+    return ec.generate_private_key(ec.SECP384R1())
+
+
+@pytest.fixture
+def fake_esapi(monkeypatch) -> FakeEsapi:
+    esapi = FakeEsapi({})
+    monkeypatch.setattr(tpm_key_manager, "_get_pooled_esapi", lambda tcti_name: esapi)
+    return esapi
+
+
+@pytest.fixture
+def tpm_backend(monkeypatch, setup_test_environment, fake_esapi, tpm_private_key) -> TpmKeyBackend:
+    """A TpmKeyBackend whose default key is indexed, with signing done in software."""
+    fake_esapi.persistent_keys[PERSISTENT_HANDLE] = tpm_private_key
+    monkeypatch.setattr(
+        TpmKeyBackend,
+        "sign_digest",
+        lambda self, key_id, digest: tpm_private_key.sign(digest, ECDSA_PREHASHED_SHA256),
+    )
+    insert_tpm_key(
+        _key_id(tpm_private_key),
+        PERSISTENT_HANDLE,
+        DEFAULT_TPM_KEY_LABEL,
+        "ES384",
+        _Public(tpm_private_key).to_pem(),
+        setup_test_environment,
+    )
+    backend = TpmKeyBackend(db_path=setup_test_environment)
+    set_key_manager(backend)
+    return backend
+
+
+def test_export_verifies_tpm_signatures_in_parallel(
+    tmp_path: Path, setup_test_environment: Path, tpm_backend: TpmKeyBackend
+):
+    # Enough sign events over several artifacts to verify them on the policy's thread pool
+    db_path = setup_test_environment
+    for i in range(PARALLEL_VERIFY_MIN_SIGNATURES + 4):
+        input_path = tmp_path / f"input_{i}.txt"
+        input_path.write_text(f"artifact {i}")
+        content_hash, _, _ = api.capture(input_path, db_path)
+        api.sign(content_hash, db_path)
+
+    result = api.export(tmp_path / "dist" / "export.tar.gz", tmp_path / "checksums.txt", db_path)
+    assert result is not None
+    assert (tmp_path / "dist" / "export.tar.gz").exists()
+
+
+def test_generate_key_pair_adopts_legacy_key(
+    setup_test_environment: Path, fake_esapi: FakeEsapi, tpm_private_key
+):
+    # A key persisted before the tpm_keys index existed becomes the default key
+    fake_esapi.persistent_keys[LEGACY_PERSISTENT_HANDLE] = tpm_private_key
+    backend = TpmKeyBackend(db_path=setup_test_environment)
+
+    key_id, _ = backend.generate_key_pair()
+    assert key_id == _key_id(tpm_private_key)
+    assert [
+        (record["key_id"], record["persistent_handle"], record["label"])
+        for record in get_all_tpm_keys(setup_test_environment)
+    ] == [(key_id, LEGACY_PERSISTENT_HANDLE, DEFAULT_TPM_KEY_LABEL)]
+    assert list(fake_esapi.persistent_keys) == [LEGACY_PERSISTENT_HANDLE]
+
+
+def test_generate_key_pair_skips_used_handles(setup_test_environment: Path, fake_esapi: FakeEsapi):
+    # Handles persisted by other tools aren't in the index, and one more is taken mid-generate
+    fake_esapi.persistent_keys[PERSISTENT_HANDLE] = ec.generate_private_key(ec.SECP384R1())
+    fake_esapi.persistent_keys[PERSISTENT_HANDLE + 1] = ec.generate_private_key(ec.SECP384R1())
+    fake_esapi.taken_concurrently.add(PERSISTENT_HANDLE + 2)
+    backend = TpmKeyBackend(db_path=setup_test_environment)
+
+    key_id, _ = backend.generate_key_pair(label="release")
+    assert key_id == _key_id(fake_esapi.persistent_keys[PERSISTENT_HANDLE + 3])
+    assert [
+        (record["key_id"], record["persistent_handle"], record["label"])
+        for record in get_all_tpm_keys(setup_test_environment)
+    ] == [(key_id, PERSISTENT_HANDLE + 3, "release")]
+
+
+def test_key_generate_reports_existing_key(setup_test_environment: Path, fake_esapi: FakeEsapi):
+    runner = CliRunner(catch_exceptions=False)
+    result = runner.invoke(cli, ["--backend", "tpm", "key", "generate", "--label", "release"])
+    assert result.exit_code == 0
+    assert "Generated key with ID: " in result.output
+    key_id = result.output.split("Generated key with ID: ")[1].split()[0]
+
+    result = runner.invoke(cli, ["--backend", "tpm", "key", "generate", "--label", "release"])
+    assert result.exit_code == 0
+    assert f"Key already exists with ID: {key_id}" in result.output
+    assert "Generated key" not in result.output
+    assert len(get_all_tpm_keys(setup_test_environment)) == 1
+
+
+def test_verify_signature_accepts_legacy_raw_signatures(
+    tpm_backend: TpmKeyBackend, tpm_private_key
+):
+    key_id = _key_id(tpm_private_key)
+    digest = hashlib.sha256(b"artifact").digest()
+    r, s = utils.decode_dss_signature(tpm_private_key.sign(digest, ECDSA_PREHASHED_SHA256))
+    raw_signature = r.to_bytes(48, "big") + s.to_bytes(48, "big")
+
+    assert tpm_backend.verify_signature(key_id, raw_signature, digest)
+    assert not tpm_backend.verify_signature(key_id, raw_signature, hashlib.sha256(b"x").digest())
+    assert not tpm_backend.verify_signature(key_id, b"\x30\x02\x02", digest)
+
+
+def test_export_ignores_malformed_signatures(
+    tmp_path: Path, setup_test_environment: Path, tpm_backend: TpmKeyBackend
+):
+    db_path = setup_test_environment
+    input_path = tmp_path / "input.txt"
+    input_path.write_text("artifact")
+    content_hash, _, _ = api.capture(input_path, db_path)
+    api.sign(content_hash, db_path)
+    insert_event(
+        {
+            "ts": "2025-09-21T12:00:00.000Z",
+            "action": "sign",
+            "by": tpm_backend.list_keys()[0]["id"],
+            "artifact_hash": content_hash,
+            "artifact_signature": "not hex",
+        },
+        db_path,
+    )
+
+    assert can_export([content_hash], db_path)